@@ -2,14 +2,17 @@
 K2Think API 代理服务 - 重构版本
 提供OpenAI兼容的API接口，代理到K2Think服务
 """
+import os
+import sys
 import time
 import logging
 from contextlib import asynccontextmanager
 from typing import Optional, Annotated
 
-from fastapi import FastAPI, Request, Depends, HTTPException, status
+import aiohttp
+from fastapi import APIRouter, FastAPI, Request, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, Response, FileResponse
+from fastapi.responses import Response, FileResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
 from src.config import Config
@@ -17,7 +20,7 @@ from src.constants import APIConstants
 from src.exceptions import K2ThinkProxyError
 from src.models import ChatCompletionRequest
 from src.api_handler import APIHandler
-from src.utils import configure_logging_encoding, safe_str
+from src.utils import configure_logging_encoding, dump_json_bytes, safe_str, ORJSONResponse
 
 # 初始化配置
 try:
@@ -36,19 +39,35 @@ logger = logging.getLogger(__name__)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("K2Think API Proxy 启动中...")
-    yield
-    logger.info("K2Think API Proxy 关闭中...")
+    # 整个应用生命周期内复用同一个会话和连接池
+    app.state.http = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=Config.MAX_CONNECTIONS,
+            limit_per_host=Config.MAX_CONNECTIONS_PER_HOST,
+            keepalive_timeout=Config.KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=Config.DNS_CACHE_TTL
+        ),
+        timeout=aiohttp.ClientTimeout(total=Config.REQUEST_TIMEOUT, connect=10.0)
+    )
+    api_handler.set_http_session(app.state.http)
+    try:
+        yield
+    finally:
+        logger.info("K2Think API Proxy 关闭中...")
+        api_handler.set_http_session(None)
+        await app.state.http.close()
 
 # 创建FastAPI应用
-app = FastAPI(
+fastapi_app = FastAPI(
     title="K2Think API Proxy", 
     description="OpenAI兼容的K2Think API代理服务",
     version="2.0.0",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
 # CORS配置
-app.add_middleware(
+fastapi_app.add_middleware(
     CORSMiddleware,
     allow_origins=Config.CORS_ORIGINS,
     allow_credentials=True,
@@ -59,63 +78,72 @@ app.add_middleware(
 # 初始化API处理器
 api_handler = APIHandler(Config)
 
-@app.get("/")
+# 静态响应内容在启动时序列化一次
+_HOMEPAGE_BYTES = dump_json_bytes({
+    "status": "success",
+    "message": "K2Think API Proxy is running",
+    "service": "K2Think API Gateway", 
+    "model": APIConstants.MODEL_ID,
+    "version": "2.1.0",
+    "features": [
+        "Token轮询和负载均衡",
+        "自动失效检测和重试",
+        "Token池管理"
+    ],
+    "endpoints": {
+        "chat": "/v1/chat/completions",
+        "models": "/v1/models",
+        "health": "/health",
+        "admin": {
+            "token_stats": "/admin/tokens/stats",
+            "reset_token": "/admin/tokens/reset/{token_index}",
+            "reset_all": "/admin/tokens/reset-all", 
+            "reload_tokens": "/admin/tokens/reload"
+        }
+    }
+})
+
+_HEALTH_CONFIG = {
+    "tool_support": Config.TOOL_SUPPORT,
+    "debug_logging": Config.DEBUG_LOGGING,
+    "note": "思考内容输出现在通过模型名控制"
+}
+
+@fastapi_app.get("/")
 async def homepage():
     """首页 - 返回服务状态"""
-    return JSONResponse(content={
-        "status": "success",
-        "message": "K2Think API Proxy is running",
-        "service": "K2Think API Gateway", 
-        "model": APIConstants.MODEL_ID,
-        "version": "2.1.0",
-        "features": [
-            "Token轮询和负载均衡",
-            "自动失效检测和重试",
-            "Token池管理"
-        ],
-        "endpoints": {
-            "chat": "/v1/chat/completions",
-            "models": "/v1/models",
-            "health": "/health",
-            "admin": {
-                "token_stats": "/admin/tokens/stats",
-                "reset_token": "/admin/tokens/reset/{token_index}",
-                "reset_all": "/admin/tokens/reset-all", 
-                "reload_tokens": "/admin/tokens/reload"
-            }
-        }
-    })
+    return Response(content=_HOMEPAGE_BYTES, media_type="application/json")
 
-@app.get("/health")
-async def health_check():
-    """健康检查"""
+def build_health_payload() -> dict:
+    """构建健康检查响应内容"""
     token_manager = Config.get_token_manager()
     token_stats = token_manager.get_token_stats()
     
-    return JSONResponse(content={
+    return {
         "status": "healthy",
         "timestamp": int(time.time()),
-        "config": {
-            "tool_support": Config.TOOL_SUPPORT,
-            "debug_logging": Config.DEBUG_LOGGING,
-            "note": "思考内容输出现在通过模型名控制"
-        },
+        "config": _HEALTH_CONFIG,
         "tokens": {
             "total": token_stats["total_tokens"],
             "active": token_stats["active_tokens"],
             "inactive": token_stats["inactive_tokens"]
         }
-    })
+    }
+
+@fastapi_app.get("/health")
+async def health_check():
+    """健康检查"""
+    return ORJSONResponse(content=build_health_payload())
 
-@app.get("/favicon.ico")
+@fastapi_app.get("/favicon.ico")
 async def favicon():
     """返回favicon"""
     return Response(content="", media_type="image/x-icon")
 
-@app.get("/v1/models")
+@fastapi_app.get("/v1/models")
 async def get_models():
     """获取模型列表"""
-    return await api_handler.get_models()
+    return Response(content=await api_handler.get_models_bytes(), media_type="application/json")
 
 
 # 添加 token 验证依赖函数
@@ -126,26 +154,31 @@ async def authenticate_client(auth: Optional[HTTPAuthorizationCredentials] = Dep
 
 AuthDep = Annotated[str, Depends(authenticate_client)]
 
-@app.post("/v1/chat/completions")
-async def chat_completions(request: ChatCompletionRequest, auth_request: Request, token: AuthDep):
+@fastapi_app.post("/v1/chat/completions")
+async def chat_completions(request: ChatCompletionRequest, token: AuthDep):
     """处理聊天补全请求"""
-    return await api_handler.chat_completions(request, auth_request)
+    return await api_handler.chat_completions(request)
+
+
+# 管理接口路由，统一要求API密钥认证
+admin_router = APIRouter(prefix="/admin", dependencies=[Depends(authenticate_client)])
+mgmt_router = APIRouter(prefix=Config.ADMIN_PAGE_PATH, dependencies=[Depends(authenticate_client)])
 
 
-# 添加管理页面路由
-@app.get(f"{Config.ADMIN_PAGE_PATH}")
+# 管理页面本身为静态文件，页面内的接口请求携带API密钥
+@fastapi_app.get(f"{Config.ADMIN_PAGE_PATH}")
 async def admin_page():
     """管理页面"""
     return FileResponse('templates/admin.html')
 
 
-@app.get(f"{Config.ADMIN_PAGE_PATH}/status")
+@mgmt_router.get("/status")
 async def admin_status():
     """获取管理页面状态信息"""
     token_manager = Config.get_token_manager()
     token_stats = token_manager.get_token_stats()
 
-    return JSONResponse(content={
+    return ORJSONResponse(content={
         "mode": Config.PROXY_MODE,
         "token_stats": token_stats,
         "config": {
@@ -157,7 +190,7 @@ async def admin_status():
     })
 
 
-@app.post(f"{Config.ADMIN_PAGE_PATH}/switch_mode")
+@mgmt_router.post("/switch_mode")
 async def switch_proxy_mode(request: Request):
     """切换代理模式"""
     try:
@@ -165,49 +198,49 @@ async def switch_proxy_mode(request: Request):
         mode = data.get("mode")
 
         if mode not in ["guest", "user"]:
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=400,
                 content={"status": "error", "message": "无效的模式，必须是 'guest' 或 'user'"}
             )
 
         success = Config.switch_proxy_mode(mode)
         if success:
-            return JSONResponse(content={
+            return ORJSONResponse(content={
                 "status": "success",
                 "message": f"已切换到{'游客代理' if mode == 'guest' else '用户代理'}模式",
                 "mode": mode
             })
         else:
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=500,
                 content={"status": "error", "message": "切换模式失败"}
             )
     except Exception as e:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={"status": "error", "message": f"切换模式时出错: {safe_str(e)}"}
         )
 
 
-@app.get(f"{Config.ADMIN_PAGE_PATH}/tokens/content")
+@mgmt_router.get("/tokens/content")
 async def get_tokens_content():
     """获取当前Token文件内容"""
     try:
         token_manager = Config.get_token_manager()
         tokens = [t['token'] for t in token_manager.tokens]
 
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "status": "success",
             "tokens": tokens
         })
     except Exception as e:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={"status": "error", "message": f"获取Token内容失败: {safe_str(e)}"}
         )
 
 
-@app.post(f"{Config.ADMIN_PAGE_PATH}/tokens/update")
+@mgmt_router.post("/tokens/update")
 async def update_tokens(request: Request):
     """更新Token文件内容"""
     try:
@@ -215,47 +248,47 @@ async def update_tokens(request: Request):
         tokens = data.get("tokens", [])
 
         if not isinstance(tokens, list):
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=400,
                 content={"status": "error", "message": "Token必须是列表格式"}
             )
 
         tm = Config.get_token_manager()
-        tm.save_tokens(tokens)
+        await tm.save_tokens_async(tokens)
 
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "status": "success",
             "message": "Token更新成功"
         })
     except Exception as e:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={"status": "error", "message": f"更新Token失败: {safe_str(e)}"}
         )
 
 
-@app.get("/admin/tokens/stats")
+@admin_router.get("/tokens/stats")
 async def get_token_stats():
     """获取token池统计信息"""
     token_manager = Config.get_token_manager()
     stats = token_manager.get_token_stats()
-    return JSONResponse(content={
+    return ORJSONResponse(content={
         "status": "success",
         "data": stats
     })
 
-@app.post("/admin/tokens/reset/{token_index}")
+@admin_router.post("/tokens/reset/{token_index}")
 async def reset_token(token_index: int):
     """重置指定索引的token"""
     token_manager = Config.get_token_manager()
     success = token_manager.reset_token(token_index)
     if success:
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "status": "success",
             "message": f"Token {token_index} 已重置"
         })
     else:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=400,
             content={
                 "status": "error",
@@ -263,30 +296,30 @@ async def reset_token(token_index: int):
             }
         )
 
-@app.post("/admin/tokens/reset-all")
+@admin_router.post("/tokens/reset-all")
 async def reset_all_tokens():
     """重置所有token"""
     token_manager = Config.get_token_manager()
     token_manager.reset_all_tokens()
-    return JSONResponse(content={
+    return ORJSONResponse(content={
         "status": "success",
         "message": "所有token已重置"
     })
 
-@app.post("/admin/tokens/reload")
+@admin_router.post("/tokens/reload")
 async def reload_tokens():
     """重新加载token文件"""
     try:
         Config.reload_tokens()
         token_manager = Config.get_token_manager()
         stats = token_manager.get_token_stats()
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "status": "success",
             "message": "Token文件已重新加载",
             "data": stats
         })
     except Exception as e:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={
                 "status": "error",
@@ -294,10 +327,13 @@ async def reload_tokens():
             }
         )
 
-@app.exception_handler(K2ThinkProxyError)
+fastapi_app.include_router(mgmt_router)
+fastapi_app.include_router(admin_router)
+
+@fastapi_app.exception_handler(K2ThinkProxyError)
 async def proxy_exception_handler(request: Request, exc: K2ThinkProxyError):
     """处理自定义代理异常"""
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={
             "error": {
@@ -307,14 +343,67 @@ async def proxy_exception_handler(request: Request, exc: K2ThinkProxyError):
         }
     )
 
-@app.exception_handler(404)
+@fastapi_app.exception_handler(404)
 async def not_found_handler(request: Request, exc):
     """处理404错误"""
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=404,
         content={"error": "Not Found"}
     )
 
+class HealthInterceptor:
+    """
+    纯ASGI拦截器：直接响应健康检查和favicon请求
+    探针请求无需经过CORS中间件、路由和异常处理，健康数据按TTL缓存
+    """
+    
+    PATHS = frozenset({"/health", "/favicon.ico"})
+    
+    def __init__(self, app, cache_ttl: float = 1.0):
+        self.app = app
+        self.cache_ttl = cache_ttl
+        self._health_body = b""
+        self._health_expires = 0.0
+    
+    def _get_health_body(self) -> bytes:
+        now = time.monotonic()
+        if now >= self._health_expires:
+            self._health_body = dump_json_bytes(build_health_payload())
+            self._health_expires = now + self.cache_ttl
+        return self._health_body
+    
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["path"] not in self.PATHS
+            or scope["method"] not in ("GET", "HEAD")
+            # 跨域请求仍交给FastAPI处理，保证CORS响应头
+            or any(name == b"origin" for name, _ in scope["headers"])
+        ):
+            await self.app(scope, receive, send)
+            return
+        
+        if scope["path"] == "/health":
+            body, media_type = self._get_health_body(), b"application/json"
+        else:
+            body, media_type = b"", b"image/x-icon"
+        
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", media_type),
+                (b"content-length", str(len(body)).encode("ascii"))
+            ]
+        })
+        await send({
+            "type": "http.response.body",
+            "body": body if scope["method"] == "GET" else b""
+        })
+
+# 对外暴露包装后的ASGI应用，fastapi_app保留给需要直接访问FastAPI实例的场景
+app = HealthInterceptor(fastapi_app)
+
 if __name__ == "__main__":
     import uvicorn
     
@@ -326,10 +415,18 @@ if __name__ == "__main__":
     logger.info(f"工具支持: {Config.TOOL_SUPPORT}")
     logger.info("思考内容输出: 通过模型名控制 (MBZUAI-IFM/K2-Think vs MBZUAI-IFM/K2-Think-nothink)")
     
+    # 调试模式下固定单进程；多进程时需以导入字符串方式加载应用
+    workers = 1 if Config.DEBUG_LOGGING else (Config.WORKERS or os.cpu_count() or 1)
+    logger.info(f"工作进程数: {workers}")
+    
     uvicorn.run(
-        app, 
+        "k2think_proxy:app" if workers > 1 else app, 
         host=Config.HOST, 
         port=Config.PORT, 
+        workers=workers,
+        # uvloop 不支持 Windows
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
         access_log=Config.ENABLE_ACCESS_LOG,
         log_level=log_level
     )
\ No newline at end of file
@@ -4,44 +4,79 @@ API处理模块
 """
 import json
 import time
+import random
 import asyncio
 import logging
-from typing import Dict, List
-from fastapi import HTTPException, Request
-from fastapi.responses import StreamingResponse, JSONResponse
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import aiohttp
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 
 from src.config import Config
 from src.constants import (
     APIConstants, ResponseConstants, LogMessages, 
-    ErrorMessages, HeaderConstants
+    HeaderConstants
 )
 from src.exceptions import (
-    AuthenticationError, SerializationError, 
+    APIError, SerializationError, 
     K2ThinkProxyError
 )
 from src.models import ChatCompletionRequest, ModelsResponse, ModelInfo
 from src.tool_handler import ToolHandler
 from src.response_processor import ResponseProcessor
 from src.token_manager import TokenManager
-from src.utils import safe_str
+from src.utils import dump_json_bytes, safe_str, ORJSONResponse
 
 logger = logging.getLogger(__name__)
 
+# 上游请求头中固定不变的部分，模块加载时构建一次
+_STATIC_UPSTREAM_HEADERS: Dict[str, str] = {
+    HeaderConstants.CONTENT_TYPE: HeaderConstants.APPLICATION_JSON,
+    HeaderConstants.ORIGIN: "https://www.k2think.ai",
+    HeaderConstants.USER_AGENT: HeaderConstants.DEFAULT_USER_AGENT,
+}
+_ACCEPT_HEADER = HeaderConstants.ACCEPT
+# 流式/非流式请求各自完整的固定请求头，构建请求头时只需一次合并
+_STREAM_UPSTREAM_HEADERS: Dict[str, str] = {
+    **_STATIC_UPSTREAM_HEADERS, _ACCEPT_HEADER: HeaderConstants.EVENT_STREAM_JSON
+}
+_JSON_UPSTREAM_HEADERS: Dict[str, str] = {
+    **_STATIC_UPSTREAM_HEADERS, _ACCEPT_HEADER: HeaderConstants.APPLICATION_JSON
+}
+_REFERER_HEADER = HeaderConstants.REFERER
+_AUTHORIZATION_HEADER = HeaderConstants.AUTHORIZATION
+_REFERER_PREFIX = "https://www.k2think.ai/c/"
+_BEARER_PREFIX = APIConstants.BEARER_PREFIX
+# 流式响应的固定响应头；生成器输出的SSE帧已是bytes，StreamingResponse直接写出
+_SSE_RESPONSE_HEADERS: Dict[str, str] = {
+    HeaderConstants.CACHE_CONTROL: HeaderConstants.NO_CACHE,
+    HeaderConstants.CONNECTION: HeaderConstants.KEEP_ALIVE,
+    HeaderConstants.X_ACCEL_BUFFERING: HeaderConstants.NO_BUFFERING
+}
+
 class APIHandler:
     """API处理器"""
     
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, http_session: Optional[aiohttp.ClientSession] = None):
         self.config = config
         self.tool_handler = ToolHandler(config)
-        self.response_processor = ResponseProcessor(config, self.tool_handler)
-        self.token_manager = config.get_token_manager()
+        self.response_processor = ResponseProcessor(config, self.tool_handler, http_session)
+        # 启动时加载token池，后续每次使用时取当前实例（切换代理模式会替换实例）
+        config.get_token_manager()
+        # 限制同时发往上游的请求数，与连接池上限保持一致
+        self._upstream_sem = asyncio.Semaphore(config.MAX_UPSTREAM_CONCURRENCY)
+        self._models_bytes: Optional[bytes] = None
+    
+    @property
+    def token_manager(self) -> TokenManager:
+        """当前代理模式对应的token管理器"""
+        return self.config.get_token_manager()
     
-    def validate_api_key(self, authorization: str) -> bool:
-        """验证API密钥"""
-        if not authorization or not authorization.startswith(APIConstants.BEARER_PREFIX):
-            return False
-        api_key = authorization[APIConstants.BEARER_PREFIX_LENGTH:]  # 移除 "Bearer " 前缀
-        return api_key == self.config.VALID_API_KEY
+    def set_http_session(self, http_session: Optional[aiohttp.ClientSession]) -> None:
+        """注入应用级共享的HTTP会话（同一会话供所有请求复用，只在应用关闭时关闭）"""
+        self.response_processor.http = http_session
     
     def should_output_thinking(self, model_name: str) -> bool:
         """根据模型名判断是否应该输出思考内容"""
@@ -55,97 +90,73 @@ class APIHandler:
     
     async def get_models(self) -> ModelsResponse:
         """获取模型列表"""
+        created = int(time.time())
         model_info_standard = ModelInfo(
             id=APIConstants.MODEL_ID,
-            created=int(time.time()),
+            created=created,
             owned_by=APIConstants.MODEL_OWNER,
             root=APIConstants.MODEL_ROOT
         )
         model_info_nothink = ModelInfo(
             id=APIConstants.MODEL_ID_NOTHINK,
-            created=int(time.time()),
+            created=created,
             owned_by=APIConstants.MODEL_OWNER,
             root=APIConstants.MODEL_ROOT
         )
         return ModelsResponse(data=[model_info_standard, model_info_nothink])
     
-    async def chat_completions(self, request: ChatCompletionRequest, auth_request: Request):
-        """处理聊天补全请求"""
-        # 验证API密钥
-        authorization = auth_request.headers.get(HeaderConstants.AUTHORIZATION, "")
-        if not self.validate_api_key(authorization):
-            raise AuthenticationError()
-        
+    async def get_models_bytes(self) -> bytes:
+        """获取序列化后的模型列表（内容静态，首次调用后缓存）"""
+        if self._models_bytes is None:
+            self._models_bytes = dump_json_bytes(jsonable_encoder(await self.get_models()))
+        return self._models_bytes
+    
+    async def chat_completions(self, request: ChatCompletionRequest):
+        """处理聊天补全请求（API密钥已由路由依赖验证）"""
         # 判断是否应该输出思考内容
         output_thinking = self.should_output_thinking(request.model)
         actual_model_id = self.get_actual_model_id(request.model)
         
         try:
-            # 处理消息
-            raw_messages = self._process_raw_messages(request.messages)
-            
             # 检查工具是否启用和存在
             has_tools = self._check_tools_enabled(request)
             
-            self._log_request_info(raw_messages, has_tools, request.tools)
+            self._log_request_info(request.messages, has_tools, request.tools)
             
-            # 处理工具相关消息
-            processed_messages = self._process_messages_with_tools(
-                raw_messages, request, has_tools
-            )
+            # 构建K2Think格式的消息
+            k2think_messages = self._prepare_k2think_messages(request, has_tools)
             
             # 构建K2Think请求
             k2think_payload = self._build_k2think_payload(
-                request, processed_messages, actual_model_id
+                request, k2think_messages, actual_model_id
             )
             
-            # 验证JSON序列化
-            self._validate_json_serialization(k2think_payload)
+            # 序列化请求体（只序列化一次，重试时复用）
+            payload_bytes = self._serialize_payload(k2think_payload)
             
-            # 处理响应（带重试机制）
+            # 处理响应（非流式带重试机制；流式响应开始后无法更换token，只标记token状态）
             if request.stream:
-                return await self._handle_stream_response_with_retry(
-                    request, k2think_payload, has_tools, output_thinking
+                return await self._handle_stream_response(
+                    request, k2think_payload, payload_bytes, has_tools, output_thinking
                 )
             else:
                 return await self._handle_non_stream_response_with_retry(
-                    request, k2think_payload, has_tools, output_thinking
+                    request, k2think_payload, payload_bytes, has_tools, output_thinking
                 )
                 
         except K2ThinkProxyError:
             # 重新抛出自定义异常
             raise
         except Exception as e:
-            logger.error(f"API转发错误: {safe_str(e)}")
-            raise HTTPException(
-                status_code=APIConstants.HTTP_INTERNAL_ERROR,
-                detail={
-                    "error": {
-                        "message": safe_str(e),
-                        "type": ErrorMessages.API_ERROR
-                    }
-                }
-            )
+            logger.error("API转发错误: %s", safe_str(e))
+            raise APIError(safe_str(e))
     
     def _process_raw_messages(self, messages: List) -> List[Dict]:
-        """处理原始消息"""
-        raw_messages = []
-        for msg in messages:
-            try:
-                raw_messages.append({
-                    "role": msg.role, 
-                    "content": msg.content,  # 保持原始格式，稍后再转换
-                    "tool_calls": msg.tool_calls
-                })
-            except Exception as e:
-                logger.error(f"处理消息时出错: {safe_str(e)}, 消息: {safe_str(msg)}")
-                # 使用默认值
-                raw_messages.append({
-                    "role": msg.role, 
-                    "content": safe_str(msg.content) if msg.content else "", 
-                    "tool_calls": msg.tool_calls
-                })
-        return raw_messages
+        """处理原始消息（只读取已校验模型的字段，内容保持原始格式，稍后再转换）"""
+        return [
+            {"role": msg.role, "content": msg.content, "tool_calls": msg.tool_calls}
+            for msg in messages
+        ]
     
     def _check_tools_enabled(self, request: ChatCompletionRequest) -> bool:
         """检查工具是否启用"""
@@ -156,75 +167,74 @@ class APIHandler:
             request.tool_choice != "none"
         )
     
-    def _log_request_info(self, raw_messages: List[Dict], has_tools: bool, tools: List):
+    def _log_request_info(self, messages: List, has_tools: bool, tools: List):
         """记录请求信息"""
-        logger.info(LogMessages.TOOL_STATUS.format(
-            has_tools, len(tools) if tools else 0
-        ))
-        logger.info(LogMessages.MESSAGE_RECEIVED.format(len(raw_messages)))
+        logger.info(LogMessages.TOOL_STATUS, has_tools, len(tools) if tools else 0)
+        logger.info(LogMessages.MESSAGE_RECEIVED, len(messages))
         
-        # 记录原始消息的角色分布
-        role_count = {}
-        for msg in raw_messages:
-            role = msg.get("role", "unknown")
-            role_count[role] = role_count.get(role, 0) + 1
-        logger.info(LogMessages.ROLE_DISTRIBUTION.format("原始", role_count))
+        # 记录原始消息的角色分布（仅DEBUG级别）
+        if logger.isEnabledFor(logging.DEBUG):
+            role_count = Counter(msg.role for msg in messages)
+            logger.debug(LogMessages.ROLE_DISTRIBUTION, "原始", dict(role_count))
     
     def _process_messages_with_tools(
         self, 
         raw_messages: List[Dict], 
-        request: ChatCompletionRequest, 
-        has_tools: bool
+        request: ChatCompletionRequest
     ) -> List[Dict]:
         """处理工具相关消息"""
-        if has_tools:
-            processed_messages = self.tool_handler.process_messages_with_tools(
-                raw_messages,
-                request.tools,
-                request.tool_choice
-            )
-            logger.info(LogMessages.MESSAGE_PROCESSED.format(
-                len(raw_messages), len(processed_messages)
-            ))
-            
-            # 记录处理后消息的角色分布
-            processed_role_count = {}
-            for msg in processed_messages:
-                role = msg.get("role", "unknown")
-                processed_role_count[role] = processed_role_count.get(role, 0) + 1
-            logger.info(LogMessages.ROLE_DISTRIBUTION.format("处理后", processed_role_count))
-        else:
-            processed_messages = raw_messages
-            logger.info(LogMessages.NO_TOOLS)
+        processed_messages = self.tool_handler.process_messages_with_tools(
+            raw_messages,
+            request.tools,
+            request.tool_choice
+        )
+        logger.info(LogMessages.MESSAGE_PROCESSED, len(raw_messages), len(processed_messages))
+        
+        # 记录处理后消息的角色分布（仅DEBUG级别）
+        if logger.isEnabledFor(logging.DEBUG):
+            processed_role_count = Counter(msg.get("role", "unknown") for msg in processed_messages)
+            logger.debug(LogMessages.ROLE_DISTRIBUTION, "处理后", dict(processed_role_count))
         
         return processed_messages
     
+    def _prepare_k2think_messages(self, request: ChatCompletionRequest, has_tools: bool) -> List[Dict]:
+        """
+        构建K2Think格式的消息列表
+        无工具时直接单次遍历请求消息；只有需要注入工具提示时才生成中间消息列表
+        """
+        if has_tools:
+            raw_messages = self._process_raw_messages(request.messages)
+            processed_messages = self._process_messages_with_tools(raw_messages, request)
+            return [
+                self._to_k2think_message(msg.get("role", "user"), msg.get("content", ""))
+                for msg in processed_messages
+            ]
+        
+        logger.info(LogMessages.NO_TOOLS)
+        return [self._to_k2think_message(msg.role, msg.content) for msg in request.messages]
+    
+    def _to_k2think_message(self, role: str, content) -> Dict:
+        """将单条消息转换为K2Think格式 - 支持多模态内容"""
+        try:
+            return {
+                "role": role, 
+                "content": self.response_processor.content_to_multimodal(content)
+            }
+        except Exception as e:
+            logger.error("构建K2Think消息时出错: %s, 角色: %s", safe_str(e), safe_str(role))
+            # 使用安全的默认值
+            return {
+                "role": role or "user", 
+                "content": self.tool_handler._content_to_string(content)
+            }
+    
     def _build_k2think_payload(
         self, 
         request: ChatCompletionRequest, 
-        processed_messages: List[Dict],
+        k2think_messages: List[Dict],
         actual_model_id: str = None
     ) -> Dict:
         """构建K2Think请求负载"""
-        # 构建K2Think格式的请求体 - 支持多模态内容
-        k2think_messages = []
-        for msg in processed_messages:
-            try:
-                # 使用多模态内容转换函数
-                content = self.response_processor.content_to_multimodal(msg.get("content", ""))
-                k2think_messages.append({
-                    "role": msg["role"], 
-                    "content": content
-                })
-            except Exception as e:
-                logger.error(f"构建K2Think消息时出错: {safe_str(e)}, 消息: {safe_str(msg)}")
-                # 使用安全的默认值
-                fallback_content = self.tool_handler._content_to_string(msg.get("content", ""))
-                k2think_messages.append({
-                    "role": msg.get("role", "user"), 
-                    "content": fallback_content
-                })
-        
         # 使用实际的模型ID
         model_id = actual_model_id or APIConstants.MODEL_ID
         
@@ -259,265 +269,195 @@ class APIHandler:
             "session_id": self.response_processor.generate_session_id()
         }
     
-    def _validate_json_serialization(self, k2think_payload: Dict):
-        """验证JSON序列化"""
+    def _serialize_payload(self, k2think_payload: Dict) -> bytes:
+        """序列化K2Think请求体，序列化失败时抛出SerializationError"""
         try:
-            # 测试JSON序列化
-            json.dumps(k2think_payload, ensure_ascii=False)
+            # orjson原生支持datetime/UUID等类型
+            payload_bytes = dump_json_bytes(k2think_payload)
+        except orjson.JSONEncodeError as e:
+            logger.error(LogMessages.JSON_VALIDATION_FAILED, e)
+            raise SerializationError()
+        
+        if self.config.DEBUG_LOGGING:
             logger.info(LogMessages.JSON_VALIDATION_SUCCESS)
-        except Exception as e:
-            logger.error(LogMessages.JSON_VALIDATION_FAILED.format(e))
-            # 尝试修复序列化问题
-            try:
-                k2think_payload = json.loads(json.dumps(k2think_payload, default=str, ensure_ascii=False))
-                logger.info(LogMessages.JSON_FIXED)
-            except Exception as fix_error:
-                logger.error(f"无法修复序列化问题: {fix_error}")
-                raise SerializationError()
+        return payload_bytes
     
-    def _build_request_headers(self, request: ChatCompletionRequest, k2think_payload: Dict, token: str) -> Dict[str, str]:
-        """构建请求头"""
-        return {
-            HeaderConstants.ACCEPT: (
-                HeaderConstants.EVENT_STREAM_JSON if request.stream 
-                else HeaderConstants.APPLICATION_JSON
-            ),
-            HeaderConstants.CONTENT_TYPE: HeaderConstants.APPLICATION_JSON,
-            HeaderConstants.AUTHORIZATION: f"{APIConstants.BEARER_PREFIX}{token}",
-            HeaderConstants.ORIGIN: "https://www.k2think.ai",
-            HeaderConstants.REFERER: "https://www.k2think.ai/c/" + k2think_payload["chat_id"],
-            HeaderConstants.USER_AGENT: HeaderConstants.DEFAULT_USER_AGENT
-        }
+    def _build_request_headers(self, request: ChatCompletionRequest, k2think_payload: Dict) -> Dict[str, str]:
+        """构建不含认证信息的请求头（每个请求构建一次，重试时复用）"""
+        static_headers = _STREAM_UPSTREAM_HEADERS if request.stream else _JSON_UPSTREAM_HEADERS
+        return {**static_headers, _REFERER_HEADER: _REFERER_PREFIX + k2think_payload["chat_id"]}
     
-    async def _handle_stream_response(
-        self, 
-        k2think_payload: Dict, 
-        headers: Dict[str, str], 
-        has_tools: bool,
-        output_thinking: bool = True,
-        original_model: str = None
-    ) -> StreamingResponse:
-        """处理流式响应"""
-        return StreamingResponse(
-            self.response_processor.process_stream_response_with_tools(
-                k2think_payload, headers, has_tools, output_thinking, original_model
-            ),
-            media_type=HeaderConstants.TEXT_EVENT_STREAM,
-            headers={
-                HeaderConstants.CACHE_CONTROL: HeaderConstants.NO_CACHE,
-                HeaderConstants.CONNECTION: HeaderConstants.KEEP_ALIVE,
-                HeaderConstants.X_ACCEL_BUFFERING: HeaderConstants.NO_BUFFERING
-            }
-        )
+    def _retry_delay(self, attempt: int) -> float:
+        """计算重试等待时间：指数退避加随机抖动，避免并发请求同步重试"""
+        delay = min(self.config.RETRY_BASE_DELAY * (2 ** attempt), self.config.RETRY_MAX_DELAY)
+        return delay + random.random() * self.config.RETRY_BASE_DELAY
+    
+    def _set_token(self, headers: Dict[str, str], token: str) -> None:
+        """原地设置请求头中的token认证信息（上一次上游调用结束后才会替换）"""
+        headers[_AUTHORIZATION_HEADER] = _BEARER_PREFIX + token
     
-    async def _handle_non_stream_response(
+    async def _finalize_completion(
         self, 
-        k2think_payload: Dict, 
-        headers: Dict[str, str], 
-        has_tools: bool,
-        output_thinking: bool = True,
+        full_content: str, 
+        token_info: Dict, 
+        has_tools: bool, 
         original_model: str = None
-    ) -> JSONResponse:
-        """处理非流式响应"""
-        full_content, token_info = await self.response_processor.process_non_stream_response(
-            k2think_payload, headers, output_thinking
-        )
-        
-        # 处理工具调用
+    ) -> Dict:
+        """处理工具调用并构建OpenAI格式的完整响应"""
         tool_calls = None
         message_content = full_content
         
         if has_tools:
-            tool_calls = self.tool_handler.extract_tool_invocations(full_content)
+            tool_calls, cleaned_content = await self.tool_handler.split_tool_calls_async(full_content)
             if tool_calls:
                 # 当存在工具调用时，内容必须为null（OpenAI规范）
                 message_content = None
-                logger.info(LogMessages.TOOL_CALLS_EXTRACTED.format(
-                    json.dumps(tool_calls, ensure_ascii=False)
-                ))
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info(
+                        LogMessages.TOOL_CALLS_EXTRACTED, 
+                        json.dumps(tool_calls, ensure_ascii=False)
+                    )
             else:
-                # 从内容中移除工具JSON
-                message_content = self.tool_handler.remove_tool_json_content(full_content)
-                if not message_content:
-                    message_content = full_content  # 保留原内容如果清理后为空
+                # 保留原内容如果清理后为空
+                message_content = cleaned_content or full_content
         
-        openai_response = self.response_processor.create_completion_response(
+        return self.response_processor.create_completion_response(
             message_content, tool_calls, token_info, original_model
         )
-        
-        return JSONResponse(content=openai_response)
     
-    async def _handle_stream_response_with_retry(
+    async def _handle_stream_response(
         self, 
         request: ChatCompletionRequest,
         k2think_payload: Dict, 
+        payload_bytes: bytes,
         has_tools: bool,
-        output_thinking: bool = True,
-        max_retries: int = 3
+        output_thinking: bool = True
     ) -> StreamingResponse:
-        """处理流式响应（带重试机制）"""
-        last_exception = None
+        """
+        处理流式响应（单个token，不重试）
+        上游错误发生在响应迭代过程中，由生成器内部标记token状态
+        """
+        # token的获取和状态标记使用同一个管理器，避免期间切换代理模式
+        token_manager = self.token_manager
+        token = self._acquire_token(token_manager)
+        headers = self._build_request_headers(request, k2think_payload)
+        self._set_token(headers, token)
+        logger.info("开始流式请求")
         
-        for attempt in range(max_retries):
-            # 获取下一个可用token
-            token = self.token_manager.get_next_token()
-            if not token:
-                logger.error("没有可用的token")
-                raise HTTPException(
-                    status_code=APIConstants.HTTP_SERVICE_UNAVAILABLE,
-                    detail={
-                        "error": {
-                            "message": "所有token都已失效，请检查token配置",
-                            "type": ErrorMessages.API_ERROR
-                        }
-                    }
-                )
-            
-            # 构建请求头
-            headers = self._build_request_headers(request, k2think_payload, token)
-            
+        # 使用现有的响应处理器，但在出错时标记token失败
+        async def stream_generator():
+            # 响应处理器把上游错误转换为错误chunk，通过回调收集错误
+            errors: List[Exception] = []
             try:
-                logger.info(f"尝试流式请求 (第{attempt + 1}次)")
-                
-                # 使用现有的响应处理器，但在异常时标记token失败
-                async def stream_generator():
-                    try:
-                        async for chunk in self.response_processor.process_stream_response_with_tools(
-                            k2think_payload, headers, has_tools, output_thinking, request.model
-                        ):
-                            yield chunk
-                        # 流式响应成功完成，标记token成功
-                        self.token_manager.mark_token_success(token)
-                    except Exception as e:
-                        # 流式响应过程中出现错误，标记token失败
-                        self.token_manager.mark_token_failure(token, safe_str(e))
-                        raise e
-                
-                return StreamingResponse(
-                    stream_generator(),
-                    media_type=HeaderConstants.TEXT_EVENT_STREAM,
-                    headers={
-                        HeaderConstants.CACHE_CONTROL: HeaderConstants.NO_CACHE,
-                        HeaderConstants.CONNECTION: HeaderConstants.KEEP_ALIVE,
-                        HeaderConstants.X_ACCEL_BUFFERING: HeaderConstants.NO_BUFFERING
-                    }
-                )
+                async with self._upstream_sem:
+                    async for chunk in self.response_processor.process_stream_response_with_tools(
+                        payload_bytes, headers, has_tools, output_thinking, request.model,
+                        on_error=errors.append
+                    ):
+                        yield chunk
             except Exception as e:
-                last_exception = e
-                logger.warning(f"流式请求失败 (第{attempt + 1}次): {safe_str(e)}")
-                
-                # 标记token失败
-                token_failed = self.token_manager.mark_token_failure(token, safe_str(e))
-                if token_failed:
-                    logger.error(f"Token已被标记为失效")
-                
-                # 如果是最后一次尝试，抛出异常
-                if attempt == max_retries - 1:
-                    break
-                
-                # 短暂延迟后重试
-                await asyncio.sleep(0.5)
+                # 流式响应过程中出现错误，标记token失败
+                token_manager.mark_token_failure(token, safe_str(e))
+                raise
+            
+            if errors:
+                token_manager.mark_token_failure(token, safe_str(errors[0]))
+            else:
+                # 流式响应成功完成，标记token成功
+                token_manager.mark_token_success(token)
         
-        # 所有重试都失败了
-        logger.error(f"所有流式请求重试都失败了，最后错误: {safe_str(last_exception)}")
-        raise HTTPException(
-            status_code=APIConstants.HTTP_INTERNAL_ERROR,
-            detail={
-                "error": {
-                    "message": f"流式请求失败: {safe_str(last_exception)}",
-                    "type": ErrorMessages.API_ERROR
-                }
-            }
+        return StreamingResponse(
+            stream_generator(),
+            media_type=HeaderConstants.TEXT_EVENT_STREAM,
+            headers=_SSE_RESPONSE_HEADERS
         )
     
     async def _handle_non_stream_response_with_retry(
         self, 
         request: ChatCompletionRequest,
         k2think_payload: Dict, 
+        payload_bytes: bytes,
         has_tools: bool,
         output_thinking: bool = True,
         max_retries: int = 3
-    ) -> JSONResponse:
+    ) -> ORJSONResponse:
         """处理非流式响应（带重试机制）"""
+        async def fetch_completion(headers: Dict[str, str]) -> Tuple[str, Dict]:
+            async with self._upstream_sem:
+                return await self.response_processor.process_non_stream_response(
+                    payload_bytes, headers, output_thinking
+                )
+        
+        full_content, token_info = await self._call_with_token_retry(
+            "非流式请求",
+            self._build_request_headers(request, k2think_payload),
+            fetch_completion,
+            max_retries
+        )
+        
+        openai_response = await self._finalize_completion(
+            full_content, token_info, has_tools, request.model
+        )
+        return ORJSONResponse(content=openai_response)
+    
+    def _acquire_token(self, token_manager: TokenManager) -> str:
+        """从给定的token管理器获取下一个可用token，没有可用token时抛出异常"""
+        token = token_manager.get_next_token()
+        if not token:
+            logger.error("没有可用的token")
+            raise APIError(
+                "所有token都已失效，请检查token配置", 
+                APIConstants.HTTP_SERVICE_UNAVAILABLE
+            )
+        return token
+    
+    async def _call_with_token_retry(
+        self, 
+        label: str, 
+        headers: Dict[str, str], 
+        operation: Callable[[Dict[str, str]], Awaitable], 
+        max_retries: int = 3
+    ):
+        """
+        轮换token执行上游调用，失败时标记token并重试
+        
+        Args:
+            label: 日志中的请求描述
+            headers: 请求头，每次尝试原地替换其中的认证信息
+            operation: 接收完整请求头并执行上游调用的协程函数
+            max_retries: 最大尝试次数
+        """
         last_exception = None
         
         for attempt in range(max_retries):
-            # 获取下一个可用token
-            token = self.token_manager.get_next_token()
-            if not token:
-                logger.error("没有可用的token")
-                raise HTTPException(
-                    status_code=APIConstants.HTTP_SERVICE_UNAVAILABLE,
-                    detail={
-                        "error": {
-                            "message": "所有token都已失效，请检查token配置",
-                            "type": ErrorMessages.API_ERROR
-                        }
-                    }
-                )
-            
-            # 构建请求头
-            headers = self._build_request_headers(request, k2think_payload, token)
+            # 同一次尝试中token的获取和状态标记使用同一个管理器
+            token_manager = self.token_manager
+            token = self._acquire_token(token_manager)
+            # 只有认证信息随token变化
+            self._set_token(headers, token)
             
             try:
-                logger.info(f"尝试非流式请求 (第{attempt + 1}次)")
-                
-                # 处理响应
-                full_content, token_info = await self.response_processor.process_non_stream_response(
-                    k2think_payload, headers, output_thinking
-                )
-                
-                # 标记token成功
-                self.token_manager.mark_token_success(token)
-                
-                # 处理工具调用
-                tool_calls = None
-                message_content = full_content
-                
-                if has_tools:
-                    tool_calls = self.tool_handler.extract_tool_invocations(full_content)
-                    if tool_calls:
-                        # 当存在工具调用时，内容必须为null（OpenAI规范）
-                        message_content = None
-                        logger.info(LogMessages.TOOL_CALLS_EXTRACTED.format(
-                            json.dumps(tool_calls, ensure_ascii=False)
-                        ))
-                    else:
-                        # 从内容中移除工具JSON
-                        message_content = self.tool_handler.remove_tool_json_content(full_content)
-                        if not message_content:
-                            message_content = full_content  # 保留原内容如果清理后为空
-                
-                openai_response = self.response_processor.create_completion_response(
-                    message_content, tool_calls, token_info, request.model
-                )
-                
-                return JSONResponse(content=openai_response)
-                
+                logger.info("尝试%s (第%d次)", label, attempt + 1)
+                result = await operation(headers)
+                token_manager.mark_token_success(token)
+                return result
             except Exception as e:
                 last_exception = e
-                logger.warning(f"非流式请求失败 (第{attempt + 1}次): {safe_str(e)}")
+                logger.warning("%s失败 (第%d次): %s", label, attempt + 1, safe_str(e))
                 
                 # 标记token失败
-                token_failed = self.token_manager.mark_token_failure(token, safe_str(e))
+                token_failed = token_manager.mark_token_failure(token, safe_str(e))
                 if token_failed:
-                    logger.error(f"Token已被标记为失效")
+                    logger.error("Token已被标记为失效")
                 
                 # 如果是最后一次尝试，抛出异常
                 if attempt == max_retries - 1:
                     break
                 
-                # 短暂延迟后重试
-                await asyncio.sleep(0.5)
+                # token失效属于凭据问题，立即换下一个token重试；否则指数退避
+                if not token_failed:
+                    await asyncio.sleep(self._retry_delay(attempt))
         
         # 所有重试都失败了
-        logger.error(f"所有非流式请求重试都失败了，最后错误: {safe_str(last_exception)}")
-        raise HTTPException(
-            status_code=APIConstants.HTTP_INTERNAL_ERROR,
-            detail={
-                "error": {
-                    "message": f"非流式请求失败: {safe_str(last_exception)}",
-                    "type": ErrorMessages.API_ERROR
-                }
-            }
-        )
\ No newline at end of file
+        logger.error("所有%s重试都失败了，最后错误: %s", label, safe_str(last_exception))
+        raise APIError(f"{label}失败: {safe_str(last_exception)}")
\ No newline at end of file
@@ -4,6 +4,7 @@
 """
 import os
 import logging
+import threading
 from typing import List
 from dotenv import load_dotenv
 from src.token_manager import TokenManager
@@ -11,6 +12,12 @@ from src.token_manager import TokenManager
 # 加载环境变量
 load_dotenv()
 
+def _parse_origins(value: str) -> List[str]:
+    """解析逗号分隔的CORS来源列表"""
+    if value == "*":
+        return ["*"]
+    return [origin.strip() for origin in value.split(",") if origin.strip()]
+
 class Config:
     """应用配置类"""
     
@@ -22,13 +29,17 @@ class Config:
     # Token管理配置
     TOKENS_FILE: str = os.getenv("TOKENS_FILE", "tokens_guest.txt")
     MAX_TOKEN_FAILURES: int = int(os.getenv("MAX_TOKEN_FAILURES", "3"))
+    TOKEN_RECOVERY_DELAY: float = float(os.getenv("TOKEN_RECOVERY_DELAY", "60"))
     
-    # Token管理器实例（延迟初始化）
+    # Token管理器实例（延迟初始化），创建和替换由锁保护
     _token_manager: TokenManager = None
+    _token_manager_lock = threading.RLock()
     
     # 服务器配置
     HOST: str = os.getenv("HOST", "0.0.0.0")
     PORT: int = int(os.getenv("PORT", "8001"))
+    # 工作进程数，0表示使用CPU核心数；各进程的token状态和管理操作互相独立
+    WORKERS: int = int(os.getenv("WORKERS", "1"))
     
     # 功能开关
     TOOL_SUPPORT: bool = os.getenv("TOOL_SUPPORT", "true").lower() == "true"
@@ -47,8 +58,15 @@ class Config:
 
     # 性能配置
     REQUEST_TIMEOUT: float = float(os.getenv("REQUEST_TIMEOUT", "60"))
-    MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("MAX_KEEPALIVE_CONNECTIONS", "20"))
-    MAX_CONNECTIONS: int = int(os.getenv("MAX_CONNECTIONS", "100"))
+    RETRY_BASE_DELAY: float = float(os.getenv("RETRY_BASE_DELAY", "0.1"))
+    RETRY_MAX_DELAY: float = float(os.getenv("RETRY_MAX_DELAY", "2.0"))
+    MAX_CONNECTIONS: int = int(os.getenv("MAX_CONNECTIONS", "1000"))
+    MAX_CONNECTIONS_PER_HOST: int = int(os.getenv("MAX_CONNECTIONS_PER_HOST", "200"))
+    KEEPALIVE_TIMEOUT: float = float(os.getenv("KEEPALIVE_TIMEOUT", "75"))
+    DNS_CACHE_TTL: int = int(os.getenv("DNS_CACHE_TTL", "300"))
+    MAX_UPSTREAM_CONCURRENCY: int = int(os.getenv("MAX_UPSTREAM_CONCURRENCY", os.getenv("MAX_CONNECTIONS", "1000")))
+    # 分块延迟发送仅为模拟打字效果，默认关闭，直接整段发送
+    STREAM_PACING_ENABLED: bool = os.getenv("STREAM_PACING_ENABLED", "false").lower() == "true"
     STREAM_DELAY: float = float(os.getenv("STREAM_DELAY", "0.05"))
     STREAM_CHUNK_SIZE: int = int(os.getenv("STREAM_CHUNK_SIZE", "50"))
     MAX_STREAM_TIME: float = float(os.getenv("MAX_STREAM_TIME", "10.0"))
@@ -57,11 +75,7 @@ class Config:
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
 
     # CORS配置
-    CORS_ORIGINS: List[str] = (
-        os.getenv("CORS_ORIGINS", "*").split(",")
-        if os.getenv("CORS_ORIGINS", "*") != "*"
-        else ["*"]
-    )
+    CORS_ORIGINS: List[str] = _parse_origins(os.getenv("CORS_ORIGINS", "*"))
 
     @classmethod
     def validate(cls) -> None:
@@ -72,10 +86,19 @@ class Config:
         # 验证数值范围
         if cls.PORT < 1 or cls.PORT > 65535:
             raise ValueError(f"错误：PORT 值 {cls.PORT} 不在有效范围内 (1-65535)")
+        
+        if cls.WORKERS < 0:
+            raise ValueError("错误：WORKERS 不能为负数")
 
         if cls.REQUEST_TIMEOUT <= 0:
             raise ValueError(f"错误：REQUEST_TIMEOUT 必须大于0，当前值: {cls.REQUEST_TIMEOUT}")
 
+        if cls.RETRY_BASE_DELAY < 0 or cls.RETRY_MAX_DELAY < 0:
+            raise ValueError(f"错误：RETRY_BASE_DELAY/RETRY_MAX_DELAY 不能为负数，当前值: {cls.RETRY_BASE_DELAY}/{cls.RETRY_MAX_DELAY}")
+
+        if cls.MAX_UPSTREAM_CONCURRENCY < 1:
+            raise ValueError(f"错误：MAX_UPSTREAM_CONCURRENCY 必须大于0，当前值: {cls.MAX_UPSTREAM_CONCURRENCY}")
+
         if cls.STREAM_DELAY < 0:
             raise ValueError(f"错误：STREAM_DELAY 不能为负数，当前值: {cls.STREAM_DELAY}")
 
@@ -97,25 +120,31 @@ class Config:
 
     @classmethod
     def get_token_manager(cls) -> TokenManager:
-        """获取token管理器实例（单例模式）"""
-        if cls._token_manager is None:
-            cls._token_manager = TokenManager(
-                tokens_file=cls.TOKENS_FILE,
-                max_failures=cls.MAX_TOKEN_FAILURES
-            )
-        return cls._token_manager
+        """获取token管理器实例（单例模式，双重检查加锁，创建后读取无锁）"""
+        token_manager = cls._token_manager
+        if token_manager is None:
+            with cls._token_manager_lock:
+                token_manager = cls._token_manager
+                if token_manager is None:
+                    token_manager = TokenManager(
+                        tokens_file=cls.TOKENS_FILE,
+                        max_failures=cls.MAX_TOKEN_FAILURES,
+                        recovery_delay=cls.TOKEN_RECOVERY_DELAY
+                    )
+                    cls._token_manager = token_manager
+        return token_manager
 
     @classmethod
     def reset_token_manager(cls):
-        if cls._token_manager is not None:
+        """按当前配置重新创建token管理器"""
+        with cls._token_manager_lock:
             cls._token_manager = None
-        cls.get_token_manager()
+            # 新实例构造时已加载token文件，无需再次重新加载
+            token_manager = cls.get_token_manager()
 
-        if cls.PROXY_MODE == 'guest' and not cls._token_manager.tokens_list:
-            tokens = cls._token_manager.generate_random_tokens()
-            cls._token_manager.save_tokens(tokens)
-        else:
-            cls.reload_tokens()
+            if cls.PROXY_MODE == 'guest' and not token_manager.tokens_list:
+                tokens = token_manager.generate_random_tokens()
+                token_manager.save_tokens(tokens)
 
     @classmethod
     def reload_tokens(cls) -> None:
@@ -136,17 +165,18 @@ class Config:
         if mode not in ['guest', 'user']:
             return False
 
-        # 更新模式
-        cls.PROXY_MODE = mode
+        with cls._token_manager_lock:
+            # 更新模式
+            cls.PROXY_MODE = mode
 
-        # 根据模式更新配置
-        if mode == 'guest':
-            cls.TOKENS_FILE = cls.GUEST_TOKENS_FILE
-            cls.K2THINK_API_URL = cls.GUEST_API_URL
-        else:  # user
-            cls.TOKENS_FILE = cls.USER_TOKENS_FILE
-            cls.K2THINK_API_URL = cls.USER_API_URL
+            # 根据模式更新配置
+            if mode == 'guest':
+                cls.TOKENS_FILE = cls.GUEST_TOKENS_FILE
+                cls.K2THINK_API_URL = cls.GUEST_API_URL
+            else:  # user
+                cls.TOKENS_FILE = cls.USER_TOKENS_FILE
+                cls.K2THINK_API_URL = cls.USER_API_URL
 
-        # 重新加载token
-        cls.reset_token_manager()
+            # 重新加载token
+            cls.reset_token_manager()
         return True
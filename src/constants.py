@@ -15,6 +15,7 @@ class APIConstants:
     HTTP_UNAUTHORIZED = 401
     HTTP_NOT_FOUND = 404
     HTTP_INTERNAL_ERROR = 500
+    HTTP_SERVICE_UNAVAILABLE = 503
     HTTP_GATEWAY_TIMEOUT = 504
     
     # 认证相关
@@ -48,6 +49,9 @@ class ToolConstants:
     # 工具提示长度限制
     MAX_TOOL_PROMPT_LENGTH = 1000
     TOOL_PROMPT_TRUNCATE_SUFFIX = "..."
+    
+    # 工具提示缓存条目数（按工具定义内容缓存）
+    TOOL_PROMPT_CACHE_SIZE = 256
 
 # 内容处理相关常量
 class ContentConstants:
@@ -85,22 +89,22 @@ class ErrorMessages:
 
 # 日志消息常量
 class LogMessages:
-    TOOL_STATUS = "🔧 工具调用状态: has_tools={}, tools_count={}"
-    MESSAGE_RECEIVED = "📥 接收到的原始消息数: {}"
-    ROLE_DISTRIBUTION = "📊 {}消息角色分布: {}"
-    MESSAGE_PROCESSED = "🔄 消息处理完成，原始消息数: {}, 处理后消息数: {}"
+    # 请求处理日志使用 % 占位符，作为 logger 参数延迟格式化
+    TOOL_STATUS = "🔧 工具调用状态: has_tools=%s, tools_count=%d"
+    MESSAGE_RECEIVED = "📥 接收到的原始消息数: %d"
+    ROLE_DISTRIBUTION = "📊 %s消息角色分布: %s"
+    MESSAGE_PROCESSED = "🔄 消息处理完成，原始消息数: %d, 处理后消息数: %d"
     NO_TOOLS = "⏭️  无工具调用，直接使用原始消息"
     JSON_VALIDATION_SUCCESS = "✅ K2Think请求体JSON序列化验证通过"
-    JSON_VALIDATION_FAILED = "❌ K2Think请求体JSON序列化失败: {}"
-    JSON_FIXED = "🔧 使用default=str修复了序列化问题"
+    JSON_VALIDATION_FAILED = "❌ K2Think请求体JSON序列化失败: %s"
     
     # 动态chunk计算日志
-    DYNAMIC_CHUNK_CALC = "动态chunk_size计算: 内容长度={}, 计算值={}, 最终值={}"
+    DYNAMIC_CHUNK_CALC = "动态chunk_size计算: 内容长度=%d, 计算值=%d, 最终值=%d"
     
     # 工具相关日志
     TOOL_PROMPT_TOO_LONG = "工具提示过长 ({} 字符)，将截断"
     SYSTEM_MESSAGE_TOO_LONG = "系统消息过长 ({} 字符)，使用简化版本"
-    TOOL_CALLS_EXTRACTED = "提取到工具调用: {}"
+    TOOL_CALLS_EXTRACTED = "提取到工具调用: %s"
 
 # HTTP头常量
 class HeaderConstants:
@@ -141,6 +145,12 @@ class NumericConstants:
     # chunk大小限制
     MIN_CHUNK_SIZE = 50
     
+    # 上游SSE流每次读取的字节数
+    SSE_READ_CHUNK_SIZE = 8192
+    
+    # 工具调用解析移到线程执行的最小文本长度（字符），短文本直接在事件循环中解析
+    TOOL_PARSE_OFFLOAD_THRESHOLD = 16384
+    
     # 内容预览长度
     CONTENT_PREVIEW_LENGTH = 200
     CONTENT_PREVIEW_SUFFIX = "..."
@@ -11,6 +11,11 @@ class K2ThinkProxyError(Exception):
         self.status_code = status_code
         super().__init__(self.message)
 
+class APIError(K2ThinkProxyError):
+    """通用API错误异常"""
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message, "api_error", status_code)
+
 class ConfigurationError(K2ThinkProxyError):
     """配置错误异常"""
     def __init__(self, message: str):
@@ -2,26 +2,58 @@
 数据模型定义
 定义所有API请求和响应的数据模型
 """
-from pydantic import BaseModel
-from typing import List, Dict, Optional, Union
+from pydantic import BaseModel, ConfigDict, Discriminator, Tag
+from typing import Annotated, List, Dict, Literal, Optional, Union
 
 class ImageUrl(BaseModel):
     """Image URL model for vision content"""
+    model_config = ConfigDict(frozen=True)
+    
     url: str
     detail: Optional[str] = "auto"
 
 class ContentPart(BaseModel):
     """Content part model for OpenAI's new content format"""
+    model_config = ConfigDict(frozen=True)
+    
     type: str
     text: Optional[str] = None
     image_url: Optional[ImageUrl] = None
 
+class TextPart(ContentPart):
+    """文本内容片段"""
+    type: Literal["text"] = "text"
+
+class ImagePart(ContentPart):
+    """图像内容片段"""
+    type: Literal["image_url"] = "image_url"
+
+def _content_part_tag(value) -> str:
+    """按type字段选择内容片段模型，未知类型仍按通用ContentPart接收"""
+    part_type = value.get("type") if isinstance(value, dict) else getattr(value, "type", None)
+    return part_type if part_type in ("text", "image_url") else "other"
+
+# 按type判别的内容片段，只校验命中的分支
+ContentPartItem = Annotated[
+    Union[
+        Annotated[TextPart, Tag("text")],
+        Annotated[ImagePart, Tag("image_url")],
+        Annotated[ContentPart, Tag("other")],
+    ],
+    Discriminator(_content_part_tag),
+]
+
 class Message(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     role: str
-    content: Optional[Union[str, List[ContentPart]]] = None
+    content: Optional[Union[str, List[ContentPartItem]]] = None
     tool_calls: Optional[List[Dict]] = None
 
 class ChatCompletionRequest(BaseModel):
+    # 请求解析后不再修改；显式忽略未知字段，以兼容各类OpenAI客户端
+    model_config = ConfigDict(frozen=True, extra="ignore")
+    
     model: str = "MBZUAI-IFM/K2-Think"
     messages: List[Message]
     stream: bool = False
@@ -35,6 +67,8 @@ class ChatCompletionRequest(BaseModel):
     tool_choice: Optional[Union[str, Dict]] = None
 
 class ModelInfo(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     id: str
     object: str = "model"
     created: int
@@ -44,5 +78,7 @@ class ModelInfo(BaseModel):
     parent: Optional[str] = None
 
 class ModelsResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     object: str = "list"
     data: List[ModelInfo]
\ No newline at end of file
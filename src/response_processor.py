@@ -2,68 +2,193 @@
 响应处理模块
 处理流式和非流式响应的所有逻辑
 """
-import json
+import orjson
 import time
 import asyncio
 import logging
-import uuid
+import secrets
 from datetime import datetime
-from typing import Dict, AsyncGenerator, Tuple, Optional
-import pytz
-import httpx
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+from typing import Callable, Dict, AsyncGenerator, List, Tuple, Optional
+import aiohttp
 
 from src.constants import (
     ToolConstants,APIConstants, ResponseConstants, ContentConstants, 
-    NumericConstants, TimeConstants, HeaderConstants
+    NumericConstants, TimeConstants, HeaderConstants, LogMessages
 )
-from src.exceptions import UpstreamError, TimeoutError as ProxyTimeoutError
+from src.exceptions import UpstreamError, ConfigurationError, TimeoutError as ProxyTimeoutError
+from src.models import ImagePart, TextPart
 from src.tool_handler import ToolHandler
-from src.utils import safe_str
+from src.utils import dump_json_bytes, load_json_bytes, safe_str
 
 logger = logging.getLogger(__name__)
 
+# 思考/回答标签
+_THINK_START_TAG = ContentConstants.THINK_START_TAG
+_THINK_END_TAG = ContentConstants.THINK_END_TAG
+_ANSWER_START_TAG = ContentConstants.ANSWER_START_TAG
+_ANSWER_END_TAG = ContentConstants.ANSWER_END_TAG
+
+# 时区及时间信息中固定不变的部分
+_TZ = ZoneInfo(ContentConstants.DEFAULT_TIMEZONE)
+_STATIC_DATETIME_INFO = {
+    "{{USER_NAME}}": ContentConstants.DEFAULT_USER_NAME,
+    "{{USER_LOCATION}}": ContentConstants.DEFAULT_USER_LOCATION,
+    "{{CURRENT_TIMEZONE}}": ContentConstants.DEFAULT_TIMEZONE,
+    "{{USER_LANGUAGE}}": ContentConstants.DEFAULT_USER_LANGUAGE
+}
+
+# UUID第4版variant位可取的十六进制字符
+_UUID_VARIANT_CHARS = "89ab"
+
+
+def _random_uuid4_str() -> str:
+    """生成UUID4格式的随机字符串（直接格式化随机十六进制，不构造uuid.UUID对象）"""
+    h = secrets.token_hex(16)
+    return f"{h[:8]}-{h[8:12]}-4{h[13:16]}-{_UUID_VARIANT_CHARS[int(h[16], 16) & 3]}{h[17:20]}-{h[20:]}"
+
+
+# 内容类型
+_TEXT_TYPE = ContentConstants.TEXT_TYPE
+_IMAGE_URL_TYPE = ContentConstants.IMAGE_URL_TYPE
+
+
+@lru_cache(maxsize=1024)
+def _calc_chunk_size(content_length: int, delay: float, max_time: float,
+                     default_size: int, min_size: int) -> Tuple[int, int]:
+    """
+    按内容长度计算chunk大小（纯函数，结果缓存）
+
+    Returns:
+        Tuple[int, int]: (计算值, 最终值)
+    """
+    # 总时间 = (content_length / chunk_size) * STREAM_DELAY
+    # 解出：chunk_size = (content_length * STREAM_DELAY) / MAX_STREAM_TIME
+    calculated = int((content_length * delay) / max_time)
+
+    # 确保chunk_size不小于最小值
+    final = max(calculated, min_size)
+
+    # 如果计算出的chunk_size太大（比如内容很短），使用默认值
+    if final > content_length:
+        final = min(default_size, content_length)
+    return calculated, final
+
+
+def _text_part_to_dict(part: TextPart) -> Optional[dict]:
+    """转换TextPart对象"""
+    text = part.text
+    return {"type": _TEXT_TYPE, "text": text} if text else None
+
+
+def _image_part_to_dict(part: ImagePart) -> Optional[dict]:
+    """转换ImagePart对象"""
+    image_url_obj = part.image_url
+    if not image_url_obj:
+        return None
+    return {"type": _IMAGE_URL_TYPE, "image_url": {"url": image_url_obj.url}}
+
+
+def _dict_part_to_dict(part: dict) -> Optional[dict]:
+    """转换字典格式的内容片段"""
+    part_type = part.get("type")
+    if part_type == _TEXT_TYPE:
+        text = part.get("text")
+        return {"type": _TEXT_TYPE, "text": text} if text else None
+    if part_type == _IMAGE_URL_TYPE:
+        image_url = part.get("image_url")
+        return {"type": _IMAGE_URL_TYPE, "image_url": image_url} if image_url else None
+    return None
+
+
+def _str_part_to_dict(part: str) -> dict:
+    """转换纯文本内容片段"""
+    return {"type": _TEXT_TYPE, "text": part}
+
+
+# 内容片段按具体类型分派转换
+_PART_HANDLERS = {
+    TextPart: _text_part_to_dict,
+    ImagePart: _image_part_to_dict,
+    dict: _dict_part_to_dict,
+    str: _str_part_to_dict,
+}
+
+
+# 预编码的SSE帧片段
+_SSE_PREFIX = ResponseConstants.STREAM_DATA_PREFIX.encode()
+_SSE_SUFFIX = b"\n\n"
+_SSE_DONE = ResponseConstants.STREAM_DONE_MARKER.encode()
+
 class ResponseProcessor:
     """响应处理器"""
     
-    def __init__(self, config, tool_handler: ToolHandler):
+    def __init__(self, config, tool_handler: ToolHandler, http_session: Optional[aiohttp.ClientSession] = None):
         self.config = config
         self.tool_handler = tool_handler
+        # 应用级共享的HTTP会话，由FastAPI lifespan创建并注入
+        self.http = http_session
+        # 时间信息缓存: (秒级时间戳, 时间信息)
+        self._datetime_cache: Tuple[int, Dict[str, str]] = (0, {})
+        self._stream_timeout = aiohttp.ClientTimeout(
+            total=None, connect=10.0, sock_read=config.REQUEST_TIMEOUT
+        )
     
     def extract_answer_content(self, full_content: str, output_thinking: bool = True) -> str:
         """删除第一个<answer>标签和最后一个</answer>标签，保留内容"""
         if not full_content:
             return full_content
         
-        # 完全通过模型名控制思考内容输出，默认显示思考内容
-        should_output_thinking = output_thinking
+        # 先用 find/rfind 定位所有标签，再一次性切片拼接，避免逐步生成中间副本
+        answer_start = full_content.find(_ANSWER_START_TAG)
         
-        if should_output_thinking:
-            # 删除第一个<answer>
-            answer_start = full_content.find(ContentConstants.ANSWER_START_TAG)
+        # 完全通过模型名控制思考内容输出，默认显示思考内容
+        if output_thinking:
+            answer_end = full_content.rfind(_ANSWER_END_TAG)
+            spans = []
             if answer_start != -1:
-                full_content = full_content[:answer_start] + full_content[answer_start + len(ContentConstants.ANSWER_START_TAG):]
-
-            # 删除最后一个</answer>
-            answer_end = full_content.rfind(ContentConstants.ANSWER_END_TAG)
+                spans.append((answer_start, answer_start + len(_ANSWER_START_TAG)))
             if answer_end != -1:
-                full_content = full_content[:answer_end] + full_content[answer_end + len(ContentConstants.ANSWER_END_TAG):]
-
-            return full_content.strip()
-        else:
-            # 删除<think>部分（包括标签）
-            think_start = full_content.find(ContentConstants.THINK_START_TAG)
-            think_end = full_content.find(ContentConstants.THINK_END_TAG)
-            if think_start != -1 and think_end != -1:
-                full_content = full_content[:think_start] + full_content[think_end + len(ContentConstants.THINK_END_TAG):]
+                spans.append((answer_end, answer_end + len(_ANSWER_END_TAG)))
+            if not spans:
+                return full_content.strip()
             
-            # 删除<answer>标签及其内容之外的部分
-            answer_start = full_content.find(ContentConstants.ANSWER_START_TAG)
-            answer_end = full_content.rfind(ContentConstants.ANSWER_END_TAG)
-            if answer_start != -1 and answer_end != -1:
-                content = full_content[answer_start + len(ContentConstants.ANSWER_START_TAG):answer_end]
-                return content.strip()
-
+            # 删除第一个<answer>和最后一个</answer>
+            spans.sort()
+            pieces = []
+            pos = 0
+            for span_start, span_end in spans:
+                pieces.append(full_content[pos:span_start])
+                pos = span_end
+            pieces.append(full_content[pos:])
+            return "".join(pieces).strip()
+        
+        # 定位<think>部分（包括标签），<answer>标签只在其外部查找
+        think_start = full_content.find(_THINK_START_TAG)
+        think_end = full_content.find(_THINK_END_TAG, think_start) if think_start != -1 else -1
+        if think_end == -1:
+            cut_start = cut_end = 0
+        else:
+            cut_start, cut_end = think_start, think_end + len(_THINK_END_TAG)
+            if answer_start >= cut_start:
+                answer_start = full_content.find(_ANSWER_START_TAG, cut_end)
+        
+        answer_end = full_content.rfind(_ANSWER_END_TAG, cut_end)
+        if answer_end == -1 and cut_start:
+            answer_end = full_content.rfind(_ANSWER_END_TAG, 0, cut_start)
+        
+        # 只保留<answer>标签之间的内容
+        if answer_start != -1 and answer_end != -1:
+            content_start = answer_start + len(_ANSWER_START_TAG)
+            if content_start <= cut_start and answer_end >= cut_end:
+                # <think>部分位于<answer>内部
+                return (full_content[content_start:cut_start] + full_content[cut_end:answer_end]).strip()
+            return full_content[content_start:answer_end].strip()
+        
+        if cut_end == 0:
             return full_content.strip()
+        return (full_content[:cut_start] + full_content[cut_end:]).strip()
     
     def calculate_dynamic_chunk_size(self, content_length: int) -> int:
         """
@@ -79,22 +204,15 @@ class ResponseProcessor:
         if content_length <= 0:
             return self.config.STREAM_CHUNK_SIZE
         
-        # 计算需要的总chunk数量以满足时间限制
-        # 总时间 = chunk数量 * STREAM_DELAY
-        # chunk数量 = content_length / chunk_size
-        # 所以：总时间 = (content_length / chunk_size) * STREAM_DELAY
-        # 解出：chunk_size = (content_length * STREAM_DELAY) / MAX_STREAM_TIME
-        
-        calculated_chunk_size = int((content_length * self.config.STREAM_DELAY) / self.config.MAX_STREAM_TIME)
+        config = self.config
+        calculated_chunk_size, dynamic_chunk_size = _calc_chunk_size(
+            content_length, config.STREAM_DELAY, config.MAX_STREAM_TIME,
+            config.STREAM_CHUNK_SIZE, NumericConstants.MIN_CHUNK_SIZE
+        )
         
-        # 确保chunk_size不小于最小值
-        dynamic_chunk_size = max(calculated_chunk_size, NumericConstants.MIN_CHUNK_SIZE)
-        
-        # 如果计算出的chunk_size太大（比如内容很短），使用默认值
-        if dynamic_chunk_size > content_length:
-            dynamic_chunk_size = min(self.config.STREAM_CHUNK_SIZE, content_length)
-        
-        logger.debug(f"动态chunk_size计算: 内容长度={content_length}, 计算值={calculated_chunk_size}, 最终值={dynamic_chunk_size}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(LogMessages.DYNAMIC_CHUNK_CALC,
+                         content_length, calculated_chunk_size, dynamic_chunk_size)
         
         return dynamic_chunk_size
     
@@ -105,59 +223,16 @@ class ResponseProcessor:
         if isinstance(content, str):
             return content
         if isinstance(content, list):
-            # 检查是否包含图像内容
-            has_image = False
-            result_parts = []
-            
-            for p in content:
-                if hasattr(p, 'type'):  # ContentPart object
-                    if getattr(p, 'type') == ContentConstants.TEXT_TYPE and getattr(p, 'text', None):
-                        result_parts.append({
-                            "type": ContentConstants.TEXT_TYPE,
-                            "text": getattr(p, 'text')
-                        })
-                    elif getattr(p, 'type') == ContentConstants.IMAGE_URL_TYPE and getattr(p, 'image_url', None):
-                        has_image = True
-                        image_url_obj = getattr(p, 'image_url')
-                        if hasattr(image_url_obj, 'url'):
-                            url = getattr(image_url_obj, 'url')
-                        else:
-                            url = image_url_obj.get('url') if isinstance(image_url_obj, dict) else str(image_url_obj)
-                        
-                        result_parts.append({
-                            "type": ContentConstants.IMAGE_URL_TYPE,
-                            "image_url": {
-                                "url": url
-                            }
-                        })
-                elif isinstance(p, dict):
-                    if p.get("type") == ContentConstants.TEXT_TYPE and p.get("text"):
-                        result_parts.append({
-                            "type": ContentConstants.TEXT_TYPE, 
-                            "text": p.get("text")
-                        })
-                    elif p.get("type") == ContentConstants.IMAGE_URL_TYPE and p.get("image_url"):
-                        has_image = True
-                        result_parts.append({
-                            "type": ContentConstants.IMAGE_URL_TYPE,
-                            "image_url": p.get("image_url")
-                        })
-                elif isinstance(p, str):
-                    result_parts.append({
-                        "type": ContentConstants.TEXT_TYPE,
-                        "text": p
-                    })
+            result_parts = [
+                part for part in map(self._content_part_to_dict, content) 
+                if part is not None
+            ]
             
             # 如果包含图像，返回多模态格式；否则返回纯文本
-            if has_image and result_parts:
+            if any(part["type"] == _IMAGE_URL_TYPE for part in result_parts):
                 return result_parts
-            else:
-                # 提取所有文本内容
-                text_parts = []
-                for part in result_parts:
-                    if part.get("type") == ContentConstants.TEXT_TYPE:
-                        text_parts.append(part.get("text", ""))
-                return " ".join(text_parts)
+            # 提取所有文本内容
+            return " ".join(part["text"] for part in result_parts)
         
         # 处理其他类型
         try:
@@ -165,173 +240,270 @@ class ResponseProcessor:
         except:
             return ""
     
+    def _content_part_to_dict(self, part) -> Optional[dict]:
+        """按类型分派转换单个内容片段，无有效内容时返回None"""
+        handler = _PART_HANDLERS.get(type(part))
+        return handler(part) if handler is not None else None
+    
     def get_current_datetime_info(self) -> Dict[str, str]:
-        """获取当前时间信息"""
-        # 设置时区为上海
-        tz = pytz.timezone(ContentConstants.DEFAULT_TIMEZONE)
-        now = datetime.now(tz)
+        """获取当前时间信息（同一秒内的请求复用缓存结果，返回值不可修改）"""
+        now_s = int(time.time())
+        cached_s, cached_info = self._datetime_cache
+        if now_s == cached_s:
+            return cached_info
         
-        return {
-            "{{USER_NAME}}": ContentConstants.DEFAULT_USER_NAME,
-            "{{USER_LOCATION}}": ContentConstants.DEFAULT_USER_LOCATION,
-            "{{CURRENT_DATETIME}}": now.strftime(TimeConstants.DATETIME_FORMAT),
-            "{{CURRENT_DATE}}": now.strftime(TimeConstants.DATE_FORMAT),
-            "{{CURRENT_TIME}}": now.strftime(TimeConstants.TIME_FORMAT),
-            "{{CURRENT_WEEKDAY}}": now.strftime(TimeConstants.WEEKDAY_FORMAT),
-            "{{CURRENT_TIMEZONE}}": ContentConstants.DEFAULT_TIMEZONE,
-            "{{USER_LANGUAGE}}": ContentConstants.DEFAULT_USER_LANGUAGE
-        }
+        datetime_info = self._build_datetime_info()
+        self._datetime_cache = (now_s, datetime_info)
+        return datetime_info
+    
+    def _build_datetime_info(self) -> Dict[str, str]:
+        """构建当前时间信息"""
+        # 时区固定为上海
+        now = datetime.now(_TZ)
+        
+        datetime_info = _STATIC_DATETIME_INFO.copy()
+        datetime_info["{{CURRENT_DATETIME}}"] = now.strftime(TimeConstants.DATETIME_FORMAT)
+        datetime_info["{{CURRENT_DATE}}"] = now.strftime(TimeConstants.DATE_FORMAT)
+        datetime_info["{{CURRENT_TIME}}"] = now.strftime(TimeConstants.TIME_FORMAT)
+        datetime_info["{{CURRENT_WEEKDAY}}"] = now.strftime(TimeConstants.WEEKDAY_FORMAT)
+        return datetime_info
     
     def generate_session_id(self) -> str:
         """生成会话ID"""
-        return str(uuid.uuid4())
+        return _random_uuid4_str()
     
     def generate_chat_id(self) -> str:
         """生成聊天ID"""
-        return str(uuid.uuid4())
-    
-    async def create_http_client(self) -> httpx.AsyncClient:
-        """创建HTTP客户端"""
-        base_kwargs = {
-            "timeout": httpx.Timeout(timeout=None, connect=10.0),
-            "limits": httpx.Limits(
-                max_keepalive_connections=self.config.MAX_KEEPALIVE_CONNECTIONS, 
-                max_connections=self.config.MAX_CONNECTIONS
-            ),
-            "follow_redirects": True
-        }
-        
-        try:
-            return httpx.AsyncClient(**base_kwargs)
-        except Exception as e:
-            logger.error(f"创建客户端失败: {e}")
-            raise e
+        return _random_uuid4_str()
     
     async def make_request(
         self, 
         method: str, 
         url: str, 
         headers: dict, 
-        json_data: dict = None, 
+        data: bytes = None, 
         stream: bool = False
-    ) -> httpx.Response:
-        """发送HTTP请求"""
-        client = None
+    ) -> aiohttp.ClientResponse:
+        """发送HTTP请求（复用应用级的aiohttp会话）"""
+        if self.http is None or self.http.closed:
+            # 不在请求路径上临时创建会话，避免重复握手和连接泄漏
+            raise ConfigurationError("HTTP客户端未初始化，请通过应用lifespan启动服务")
+        
+        response = None
         
         try:
-            client = await self.create_http_client()
+            # 流式请求只限制单次读取间隔，不限制总时长；
+            # 非流式请求不传timeout，沿用会话的REQUEST_TIMEOUT（显式传None会取消所有超时）
+            request_kwargs = {"timeout": self._stream_timeout} if stream else {}
+            response = await self.http.request(
+                method, url, headers=headers, data=data, **request_kwargs
+            )
             
-            if stream:
-                # 流式请求返回context manager
-                return client.stream(method, url, headers=headers, json=json_data, timeout=None)
-            else:
-                response = await client.request(
-                    method, url, headers=headers, json=json_data, 
-                    timeout=self.config.REQUEST_TIMEOUT
-                )
-                
-                # 详细记录非200响应
-                if response.status_code != APIConstants.HTTP_OK:
-                    logger.error(f"上游API返回错误状态码: {response.status_code}")
-                    logger.error(f"响应头: {dict(response.headers)}")
-                    try:
-                        error_body = response.text
-                        logger.error(f"错误响应体: {safe_str(error_body)}")
-                    except Exception as e:
-                        logger.error(f"无法读取错误响应体: {safe_str(e)}")
-                
-                response.raise_for_status()
-                return response
+            # 详细记录非200响应
+            if response.status != APIConstants.HTTP_OK:
+                logger.error("上游API返回错误状态码: %s", response.status)
+                logger.error("响应头: %s", dict(response.headers))
+                try:
+                    error_body = await response.text()
+                    logger.error("错误响应体: %s", safe_str(error_body))
+                except Exception as e:
+                    logger.error("无法读取错误响应体: %s", safe_str(e))
+            
+            response.raise_for_status()
+            # 流式请求由调用方通过 response.content.iter_chunked() 读取并负责释放
+            return response
                 
-        except httpx.HTTPStatusError as e:
-            logger.error(f"HTTP状态错误: {e.response.status_code} - {safe_str(e.response.text)}")
-            if client and not stream:
-                await client.aclose()
-            raise UpstreamError(f"上游服务错误: {e.response.status_code}", e.response.status_code)
-        except httpx.TimeoutException as e:
-            logger.error(f"请求超时: {e}")
-            if client and not stream:
-                await client.aclose()
+        except aiohttp.ClientResponseError as e:
+            logger.error("HTTP状态错误: %s - %s", e.status, safe_str(e.message))
+            if response is not None:
+                response.release()
+            raise UpstreamError(f"上游服务错误: {e.status}", e.status)
+        except asyncio.TimeoutError as e:
+            logger.error("请求超时: %s", e)
+            if response is not None:
+                response.release()
             raise ProxyTimeoutError("请求超时")
         except Exception as e:
-            logger.error(f"请求异常: {safe_str(e)}")
-            if client and not stream:
-                await client.aclose()
+            logger.error("请求异常: %s", safe_str(e))
+            if response is not None:
+                response.release()
             raise e
     
-    async def process_non_stream_response(self, k2think_payload: dict, headers: dict, output_thinking: bool = None) -> Tuple[str, dict]:
+    async def process_non_stream_response(self, payload_bytes: bytes, headers: dict, output_thinking: bool = None) -> Tuple[str, dict]:
         """处理非流式响应"""
         try:
             response = await self.make_request(
                 "POST", 
                 self.config.K2THINK_API_URL, 
                 headers, 
-                k2think_payload, 
+                payload_bytes, 
                 stream=False
             )
             
             # K2Think 非流式请求返回标准JSON格式
-            result = response.json()
-            
-            # 提取内容
-            full_content = ""
-            if result.get('choices') and len(result['choices']) > 0:
-                choice = result['choices'][0]
-                if choice.get('message') and choice['message'].get('content'):
-                    raw_content = choice['message']['content']
-                    # 提取<answer>标签中的内容，去除标签
-                    full_content = self.extract_answer_content(raw_content, output_thinking)
-            
-            # 提取token信息
-            token_info = result.get('usage', {
-                "prompt_tokens": NumericConstants.DEFAULT_PROMPT_TOKENS, 
-                "completion_tokens": NumericConstants.DEFAULT_COMPLETION_TOKENS, 
-                "total_tokens": NumericConstants.DEFAULT_TOTAL_TOKENS
-            })
+            try:
+                result = load_json_bytes(await response.read())
+            finally:
+                response.release()
             
-            await response.aclose()
-            return full_content, token_info
+            return self._parse_completion_result(result, output_thinking)
                         
         except Exception as e:
-            logger.error(f"处理非流式响应错误: {safe_str(e)}")
+            logger.error("处理非流式响应错误: %s", safe_str(e))
             raise
     
+    def _parse_completion_result(self, result: dict, output_thinking: bool = None) -> Tuple[str, dict]:
+        """从上游的完整JSON响应中提取内容和token信息"""
+        # 提取内容
+        full_content = ""
+        if result.get('choices') and len(result['choices']) > 0:
+            choice = result['choices'][0]
+            if choice.get('message') and choice['message'].get('content'):
+                raw_content = choice['message']['content']
+                # 提取<answer>标签中的内容，去除标签
+                full_content = self.extract_answer_content(raw_content, output_thinking)
+        
+        # 提取token信息
+        token_info = result.get('usage', {
+            "prompt_tokens": NumericConstants.DEFAULT_PROMPT_TOKENS, 
+            "completion_tokens": NumericConstants.DEFAULT_COMPLETION_TOKENS, 
+            "total_tokens": NumericConstants.DEFAULT_TOTAL_TOKENS
+        })
+        
+        return full_content, token_info
+    
+    async def _iter_sse_data(self, response: aiohttp.ClientResponse) -> AsyncGenerator[str, None]:
+        """
+        按SSE事件读取上游流式响应
+        按块读取到bytearray中，以空行切分事件，每个事件只解码一次
+        
+        Yields:
+            str: 每个事件中data字段的内容
+        """
+        buffer = bytearray()
+        async for chunk in response.content.iter_chunked(NumericConstants.SSE_READ_CHUNK_SIZE):
+            buffer += chunk
+            if b"\r" in chunk:
+                buffer = buffer.replace(b"\r\n", b"\n")
+            
+            start = 0
+            while True:
+                end = buffer.find(b"\n\n", start)
+                if end == -1:
+                    break
+                data = self._parse_sse_event(buffer[start:end])
+                start = end + 2
+                if data is not None:
+                    yield data
+            if start:
+                del buffer[:start]
+        
+        # 处理末尾没有空行结束的事件
+        if buffer.strip():
+            data = self._parse_sse_event(buffer)
+            if data is not None:
+                yield data
+    
+    def _parse_sse_event(self, event: bytearray) -> Optional[str]:
+        """解析单个SSE事件，返回data字段内容（多行data以换行连接）"""
+        data_lines = [
+            line[5:].lstrip(b" ") for line in event.split(b"\n") 
+            if line.startswith(b"data:")
+        ]
+        if not data_lines:
+            return None
+        return b"\n".join(data_lines).decode("utf-8", errors="replace")
+    
+    async def _iter_upstream_deltas(self, payload_bytes: bytes, headers: dict) -> AsyncGenerator[str, None]:
+        """请求上游SSE流，逐个产出原始增量内容（含思考/回答标签）"""
+        response = await self.make_request(
+            "POST", 
+            self.config.K2THINK_API_URL, 
+            headers, 
+            payload_bytes, 
+            stream=True
+        )
+        
+        try:
+            # 上游未按流式返回时按完整JSON处理
+            if response.content_type == HeaderConstants.APPLICATION_JSON:
+                result = load_json_bytes(await response.read())
+                choices = result.get('choices') or [{}]
+                content = (choices[0].get('message') or {}).get('content')
+                if content:
+                    yield content
+                return
+            
+            async for data in self._iter_sse_data(response):
+                if data == "[DONE]":
+                    break
+                try:
+                    event = orjson.loads(data)
+                except ValueError:
+                    continue
+                delta_content = self._extract_delta_content(event)
+                if delta_content:
+                    yield delta_content
+        finally:
+            response.release()
+    
+    async def _collect_stream_content(self, payload_bytes: bytes, headers: dict, output_thinking: bool = None) -> str:
+        """读取上游SSE流并拼接完整内容"""
+        content_parts = [
+            delta_content 
+            async for delta_content in self._iter_upstream_deltas(payload_bytes, headers)
+        ]
+        # 提取<answer>标签中的内容，去除标签
+        return self.extract_answer_content("".join(content_parts), output_thinking)
+    
+    def _extract_delta_content(self, event) -> str:
+        """从上游SSE事件中提取增量内容"""
+        if not isinstance(event, dict):
+            return ""
+        choices = event.get('choices')
+        if choices:
+            delta = choices[0].get('delta') or {}
+            return delta.get('content') or ""
+        return ""
+    
     async def process_stream_response_with_tools(
         self, 
-        k2think_payload: dict, 
+        payload_bytes: bytes, 
         headers: dict, 
         has_tools: bool = False,
         output_thinking: bool = None,
-        original_model: str = None
-    ) -> AsyncGenerator[str, None]:
-        """处理流式响应 - 支持工具调用，优化性能"""
+        original_model: str = None,
+        on_error: Optional[Callable[[Exception], None]] = None
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        处理流式响应 - 支持工具调用，优化性能
+        出错时向客户端发送错误结束chunk而不抛出异常，调用方可通过on_error得知失败原因（如标记token失败）
+        """
+        # 同一响应的所有chunk共用id和创建时间
+        chunk_meta = self._create_chunk_meta(original_model)
         try:
             # 发送开始chunk
-            start_chunk = self._create_chunk_data(
+            yield self._encode_chunk_data(
                 delta={"role": "assistant", "content": ""},
                 finish_reason=None,
-                model=original_model
+                meta=chunk_meta
             )
-            yield f"{ResponseConstants.STREAM_DATA_PREFIX}{json.dumps(start_chunk)}\n\n"
             
-            # 优化的模拟流式输出 - 立即开始获取响应并流式发送
-            k2think_payload_copy = k2think_payload.copy()
-            k2think_payload_copy["stream"] = False
-            
-            headers_copy = headers.copy()
-            headers_copy[HeaderConstants.ACCEPT] = HeaderConstants.APPLICATION_JSON
-            
-            # 获取完整响应
-            full_content, token_info = await self.process_non_stream_response(k2think_payload_copy, headers_copy, output_thinking)
-            
-            if not full_content:
-                yield ResponseConstants.STREAM_DONE_MARKER
-                return
-            
-            # 处理工具调用的流式响应
             finish_reason = ResponseConstants.FINISH_REASON_STOP
-            if has_tools:
-                tool_calls = self.tool_handler.extract_tool_invocations(full_content)
+            if not has_tools:
+                # 无工具时逐段转发上游内容，无需等待完整响应
+                async for chunk in self._relay_stream_content(payload_bytes, headers, output_thinking, chunk_meta):
+                    yield chunk
+            else:
+                # 工具调用需要解析完整内容：读取上游SSE流获取完整响应
+                full_content = await self._collect_stream_content(payload_bytes, headers, output_thinking)
+                
+                if not full_content:
+                    yield _SSE_DONE
+                    return
+                
+                # 处理工具调用的流式响应
+                tool_calls, trimmed_content = await self.tool_handler.split_tool_calls_async(full_content)
                 if tool_calls:
                     # 发送工具调用
                     for i, tc in enumerate(tool_calls):
@@ -342,75 +514,117 @@ class ResponseProcessor:
                             "function": tc.get("function", {}),
                         }
                         
-                        tool_chunk = self._create_chunk_data(
+                        yield self._encode_chunk_data(
                             delta={"tool_calls": [tool_call_delta]},
                             finish_reason=None,
-                            model=original_model
+                            meta=chunk_meta
                         )
-                        yield f"{ResponseConstants.STREAM_DATA_PREFIX}{json.dumps(tool_chunk)}\n\n"
                     
                     finish_reason = ResponseConstants.FINISH_REASON_TOOL_CALLS
-                else:
+                elif trimmed_content:
                     # 发送常规内容
-                    trimmed_content = self.tool_handler.remove_tool_json_content(full_content)
-                    if trimmed_content:
-                        async for chunk in self._stream_content(trimmed_content, original_model):
-                            yield chunk
-            else:
-                # 无工具 - 发送常规内容
-                async for chunk in self._stream_content(full_content, original_model):
-                    yield chunk
+                    async for chunk in self._stream_content(trimmed_content, chunk_meta):
+                        yield chunk
             
             # 发送结束chunk
-            end_chunk = self._create_chunk_data(
+            yield self._encode_chunk_data(
                 delta={},
                 finish_reason=finish_reason,
-                model=original_model
+                meta=chunk_meta
             )
-            yield f"{ResponseConstants.STREAM_DATA_PREFIX}{json.dumps(end_chunk)}\n\n"
-            yield ResponseConstants.STREAM_DONE_MARKER
+            yield _SSE_DONE
             
         except Exception as e:
-            logger.error(f"流式响应处理错误: {safe_str(e)}")
-            error_chunk = self._create_chunk_data(
+            logger.error("流式响应处理错误: %s", safe_str(e))
+            if on_error is not None:
+                on_error(e)
+            yield self._encode_chunk_data(
                 delta={},
                 finish_reason=ResponseConstants.FINISH_REASON_ERROR,
-                model=original_model
+                meta=chunk_meta
             )
-            yield f"{ResponseConstants.STREAM_DATA_PREFIX}{json.dumps(error_chunk)}\n\n"
-            yield ResponseConstants.STREAM_DONE_MARKER
+            yield _SSE_DONE
     
-    async def _stream_content(self, content: str, model: str = None) -> AsyncGenerator[str, None]:
+    async def _relay_stream_content(
+        self, 
+        payload_bytes: bytes, 
+        headers: dict, 
+        output_thinking: bool, 
+        meta: dict
+    ) -> AsyncGenerator[bytes, None]:
+        """将上游SSE增量内容按思考输出设置过滤标签后立即转发"""
+        tag_filter = _AnswerTagFilter(output_thinking)
+        async for delta_content in self._iter_upstream_deltas(payload_bytes, headers):
+            text = tag_filter.feed(delta_content)
+            if text:
+                yield self._encode_chunk_data(
+                    delta={"content": text}, finish_reason=None, meta=meta
+                )
+        
+        text = tag_filter.finish()
+        if text:
+            yield self._encode_chunk_data(
+                delta={"content": text}, finish_reason=None, meta=meta
+            )
+    
+    async def _stream_content(self, content: str, meta: dict) -> AsyncGenerator[bytes, None]:
         """流式发送内容"""
+        if not self.config.STREAM_PACING_ENABLED:
+            # 分块延迟只是视觉效果，未开启时整段作为一个chunk发送
+            yield self._encode_chunk_data(
+                delta={"content": content}, finish_reason=None, meta=meta
+            )
+            return
+        
         chunk_size = self.calculate_dynamic_chunk_size(len(content))
+        stream_delay = self.config.STREAM_DELAY
         
-        for i in range(0, len(content), chunk_size):
-            chunk_content = content[i:i + chunk_size]
-            
-            chunk = self._create_chunk_data(
-                delta={"content": chunk_content},
+        # 先编码好全部帧，等待间隔中不再做序列化工作
+        frames = [
+            self._encode_chunk_data(
+                delta={"content": content[i:i + chunk_size]},
                 finish_reason=None,
-                model=model
+                meta=meta
             )
-            
-            yield f"{ResponseConstants.STREAM_DATA_PREFIX}{json.dumps(chunk)}\n\n"
+            for i in range(0, len(content), chunk_size)
+        ]
+        
+        if stream_delay <= 0:
+            # 无需模拟延迟时一次性发送
+            yield b"".join(frames)
+            return
+        
+        for frame in frames:
+            yield frame
             # 添加延迟模拟真实流式效果
-            await asyncio.sleep(self.config.STREAM_DELAY)
+            await asyncio.sleep(stream_delay)
+    
+    def _encode_chunk(self, chunk: dict) -> bytes:
+        """将chunk编码为SSE数据行（orjson直接输出bytes，无需再编码）"""
+        return _SSE_PREFIX + dump_json_bytes(chunk) + _SSE_SUFFIX
     
-    def _create_chunk_data(self, delta: dict, finish_reason: Optional[str], model: str = None) -> dict:
-        """创建流式响应chunk数据"""
+    def _create_chunk_meta(self, model: str = None) -> dict:
+        """创建流式响应的chunk模板（每个响应只构建一次，逐chunk原地更新choices）"""
+        now = time.time()
         return {
-            "id": f"chatcmpl-{int(time.time() * 1000)}",
+            "id": f"chatcmpl-{int(now * 1000)}",
             "object": ResponseConstants.CHAT_COMPLETION_CHUNK_OBJECT,
-            "created": int(time.time()),
+            "created": int(now),
             "model": model or APIConstants.MODEL_ID,
             "choices": [{
                 "index": 0,
-                "delta": delta,
-                "finish_reason": finish_reason
+                "delta": None,
+                "finish_reason": None
             }]
         }
     
+    def _encode_chunk_data(self, delta: dict, finish_reason: Optional[str], meta: dict) -> bytes:
+        """填充chunk模板的delta和finish_reason并立即编码为SSE数据行"""
+        choice = meta["choices"][0]
+        choice["delta"] = delta
+        choice["finish_reason"] = finish_reason
+        return self._encode_chunk(meta)
+    
     def create_completion_response(
         self, 
         content: Optional[str], 
@@ -444,4 +658,139 @@ class ResponseProcessor:
                 "completion_tokens": NumericConstants.DEFAULT_COMPLETION_TOKENS,
                 "total_tokens": NumericConstants.DEFAULT_TOTAL_TOKENS
             }
-        }
\ No newline at end of file
+        }
+
+
+class _AnswerTagFilter:
+    """
+    增量版的 extract_answer_content：逐段处理上游内容并尽早输出
+    
+    - 输出思考内容时：删除第一个<answer>和最后一个</answer>标签
+    - 不输出思考内容时：丢弃<think>部分，只输出<answer>标签之间的内容；
+      没有<answer>标签时在结束时输出去掉<think>部分后的内容
+    
+    与完整版一样会去除首尾空白；跨分段的标签会暂存到下一段再判断。
+    """
+    
+    def __init__(self, output_thinking: bool):
+        self.output_thinking = output_thinking
+        # 不输出思考内容时的状态: pre(回答开始前) / think(思考部分) / answer(回答部分)
+        self._state = "answer" if output_thinking else "pre"
+        self._answer_start_removed = False
+        self._buf = ""
+        # 最近一个</answer>及其后的内容，确认它不是最后一个后才输出
+        self._held: Optional[List[str]] = None
+        # 回答开始前暂存的内容，没有<answer>时在结束时输出
+        self._pre: List[str] = []
+        self._think: List[str] = []
+        self._started = False
+        self._trailing_ws = ""
+    
+    def _watched_tags(self) -> Tuple[str, ...]:
+        if self._state == "pre":
+            return (_THINK_START_TAG, _ANSWER_START_TAG)
+        if self._state == "think":
+            return (_THINK_END_TAG,)
+        if self.output_thinking and not self._answer_start_removed:
+            return (_ANSWER_START_TAG, _ANSWER_END_TAG)
+        return (_ANSWER_END_TAG,)
+    
+    def feed(self, text: str) -> str:
+        """处理一段上游内容，返回可以立即输出的部分"""
+        out: List[str] = []
+        buf = self._buf + text
+        
+        while buf:
+            tags = self._watched_tags()
+            pos, tag = -1, None
+            for candidate in tags:
+                found = buf.find(candidate)
+                if found != -1 and (pos == -1 or found < pos):
+                    pos, tag = found, candidate
+            
+            if tag is None:
+                # 末尾可能是被截断的标签，留到下一段再判断
+                keep = self._partial_tag_length(buf, tags)
+                self._consume(buf[:len(buf) - keep], out)
+                buf = buf[len(buf) - keep:]
+                break
+            
+            self._consume(buf[:pos], out)
+            buf = buf[pos + len(tag):]
+            self._on_tag(tag, out)
+        
+        self._buf = buf
+        return self._finalize(out)
+    
+    def finish(self) -> str:
+        """上游结束时调用，返回剩余的输出"""
+        out: List[str] = []
+        self._consume(self._buf, out)
+        self._buf = ""
+        
+        if self._held is not None:
+            # 最后一个</answer>：输出思考内容时只去掉标签本身，否则其后的内容也丢弃
+            if self.output_thinking:
+                out.append("".join(self._held)[len(_ANSWER_END_TAG):])
+            self._held = None
+        elif self._state == "think":
+            # 思考部分未闭合时不做删除
+            out.extend(self._pre)
+            out.append(_THINK_START_TAG)
+            out.extend(self._think)
+        elif self._state == "pre":
+            out.extend(self._pre)
+        
+        text = self._finalize(out)
+        self._trailing_ws = ""
+        return text
+    
+    def _consume(self, text: str, out: List[str]) -> None:
+        if not text:
+            return
+        if self._state == "pre":
+            self._pre.append(text)
+        elif self._state == "think":
+            self._think.append(text)
+        elif self._held is not None:
+            self._held.append(text)
+        else:
+            out.append(text)
+    
+    def _on_tag(self, tag: str, out: List[str]) -> None:
+        if tag == _THINK_START_TAG:
+            self._state = "think"
+        elif tag == _THINK_END_TAG:
+            self._think = []
+            self._state = "pre"
+        elif tag == _ANSWER_START_TAG:
+            # 回答开始，之前暂存的内容不再需要
+            self._pre = []
+            self._state = "answer"
+            self._answer_start_removed = True
+        else:
+            # 新的</answer>出现，说明之前暂存的不是最后一个，原样输出
+            if self._held is not None:
+                out.extend(self._held)
+            self._held = [tag]
+    
+    def _finalize(self, out: List[str]) -> str:
+        """去除开头空白，并暂存末尾空白直到后续有非空白内容"""
+        text = self._trailing_ws + "".join(out)
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return ""
+            self._started = True
+        stripped = text.rstrip()
+        self._trailing_ws = text[len(stripped):]
+        return stripped
+    
+    @staticmethod
+    def _partial_tag_length(buf: str, tags: Tuple[str, ...]) -> int:
+        """返回buf末尾可能是某个标签开头的长度"""
+        start = buf.rfind("<", max(0, len(buf) - max(len(tag) for tag in tags) + 1))
+        if start == -1:
+            return 0
+        tail = buf[start:]
+        return len(tail) if any(tag.startswith(tail) for tag in tags) else 0
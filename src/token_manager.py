@@ -3,12 +3,15 @@ Token管理模块
 负责管理K2Think的token池，实现轮询、负载均衡和失效标记
 """
 import os
-import json
+import asyncio
+import heapq
+import itertools
+import time
 import logging
 import threading
 import uuid
+from collections import Counter
 from typing import List, Dict, Optional, Tuple
-from datetime import datetime, timedelta
 
 from src.utils import safe_str
 
@@ -17,19 +20,42 @@ logger = logging.getLogger(__name__)
 class TokenManager:
     """Token管理器 - 支持轮询、负载均衡和失效标记"""
     
-    def __init__(self, tokens_file: str = "tokens.txt", max_failures: int = 3):
+    # 保存token的防抖窗口(秒)
+    SAVE_DEBOUNCE = 0.5
+    
+    def __init__(self, tokens_file: str = "tokens.txt", max_failures: int = 3, recovery_delay: float = 60.0):
         """
         初始化token管理器
         
         Args:
             tokens_file: token文件路径
             max_failures: 最大失败次数，超过后标记为失效
+            recovery_delay: 失效token首次重新探测的等待秒数，之后按指数退避；0表示不自动恢复
         """
         self.tokens_file = tokens_file
         self.max_failures = max_failures
+        self.recovery_delay = recovery_delay
         self.tokens: List[Dict] = []
+        # token字符串到token信息的索引，按token查找时无需遍历列表
+        self._by_token: Dict[str, Dict] = {}
         self.current_index = 0
         self.lock = threading.Lock()
+        # 轮询视图: (token快照, 与快照位置对齐的活跃标志)，作为一个元组整体发布，
+        # 无锁读取时快照和标志总是成对的；标志为1表示活跃，轮询时按计数值逐个检查位置
+        self._rotation: Tuple[Tuple[Dict, ...], bytearray] = ((), bytearray())
+        # 原子递增的轮询计数器
+        self._rr = itertools.count()
+        # 活跃token数量，随激活/失效同步维护
+        self._active_count = 0
+        # 失效token的重新探测时间堆: (probe_at, index, token_info)
+        self._recovery_heap: List[Tuple[float, int, Dict]] = []
+        # 堆中最早的探测时间，分配token时据此判断是否需要加锁处理恢复
+        self._next_probe_at = float('inf')
+        # 各失败次数对应的token数量，随失败计数变化同步维护
+        self._failure_counts: Counter = Counter()
+        # 防抖保存: 待写入的token列表和等待中的写入
+        self._pending_tokens: Optional[List[str]] = None
+        self._save_future: Optional[asyncio.Future] = None
         
         # 加载tokens
         self.load_tokens()
@@ -49,28 +75,51 @@ class TokenManager:
             if not os.path.exists(self.tokens_file):
                 raise FileNotFoundError(f"Token文件不存在: {self.tokens_file}")
             
+            # 一次读取后按换行切分，行内不带换行符；文本模式已将\r\n统一为\n
             with open(self.tokens_file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-            
-            self.tokens = []
-            for i, line in enumerate(lines):
-                token = line.strip()
-                if token:  # 忽略空行
-                    self.tokens.append({
-                        'token': token,
-                        'failures': 0,
-                        'is_active': True,
-                        'last_used': None,
-                        'last_failure': None,
-                        'index': i
-                    })
+                lines = f.read().split('\n')
             
+            self._install_tokens(lines)
             logger.info(f"成功加载 {len(self.tokens)} 个token")
             
         except Exception as e:
             logger.error(f"加载token文件失败: {safe_str(e)}")
             raise
     
+    def _install_tokens(self, lines: List[str]) -> None:
+        """根据token行构建新的token池并整体替换当前状态（空行保留行号但不生成token）"""
+        tokens = []
+        by_token = {}
+        for i, line in enumerate(lines):
+            token = line.strip()
+            if token:  # 忽略空行
+                token_info = {
+                    'token': token,
+                    'failures': 0,
+                    'is_active': True,
+                    # 使用/失败时间为time.monotonic()时间戳，仅用于排序和间隔计算
+                    'last_used': None,
+                    'last_failure': None,
+                    'index': i,
+                    'slot': len(tokens),
+                    'disabled_count': 0,
+                    'probe_at': None
+                }
+                tokens.append(token_info)
+                # 重复的token以首次出现的记录为准
+                by_token.setdefault(token, token_info)
+        
+        # 新的池状态在锁外构建完成，持锁只做整体替换（保存token时会在线程中调用）
+        with self.lock:
+            self.tokens = tokens
+            self._by_token = by_token
+            self._rotation = (tuple(tokens), bytearray(b"\x01" * len(tokens)))
+            self._active_count = len(tokens)
+            self._recovery_heap = []
+            self._next_probe_at = float('inf')
+            self._failure_counts = Counter({0: len(tokens)}) if tokens else Counter()
+            self.current_index = 0
+    
     def get_next_token(self) -> Optional[str]:
         """
         获取下一个可用的token（轮询算法）
@@ -78,35 +127,83 @@ class TokenManager:
         Returns:
             可用的token字符串，如果没有可用token则返回None
         """
-        with self.lock:
-            active_tokens = [t for t in self.tokens if t['is_active']]
-            
-            if not active_tokens:
-                logger.warning("没有可用的token")
-                return None
-            
-            # 轮询算法：从当前索引开始寻找下一个可用token
-            attempts = 0
-            while attempts < len(self.tokens):
-                token_info = self.tokens[self.current_index]
-                
-                if token_info['is_active']:
-                    # 更新使用时间
-                    token_info['last_used'] = datetime.now()
-                    token = token_info['token']
-                    
-                    # 移动到下一个索引
-                    self.current_index = (self.current_index + 1) % len(self.tokens)
-                    
-                    logger.debug(f"分配token (索引: {token_info['index']}, 失败次数: {token_info['failures']})")
-                    return token
-                
-                # 移动到下一个token
-                self.current_index = (self.current_index + 1) % len(self.tokens)
-                attempts += 1
-            
-            logger.warning("所有token都已失效")
+        # 只有到达失效token的探测时间时才需要加锁
+        if time.monotonic() >= self._next_probe_at:
+            with self.lock:
+                self._admit_recovered_tokens()
+        
+        # 轮询算法：无锁读取快照，计数器next()在GIL下是原子的
+        snapshot, flags = self._rotation
+        n = len(snapshot)
+        position = -1
+        # 活跃计数为0时无需扫描标志
+        if n and self._active_count:
+            # 跳过的失效位置同样消耗计数值，与按位置逐个轮询等价，失效token之后的token不会被多分配
+            for _ in range(n):
+                candidate = next(self._rr) % n
+                if flags[candidate]:
+                    position = candidate
+                    break
+        
+        if not 0 <= position < n:
+            logger.warning("没有可用的token")
             return None
+        
+        token_info = snapshot[position]
+        # 与原实现一致：current_index为token列表中下一个轮询位置
+        self.current_index = (position + 1) % n
+        
+        # 使用时间仅供展示，无需与其他字段保持一致
+        token_info['last_used'] = time.monotonic()
+        
+        logger.debug("分配token (索引: %d, 失败次数: %d)", token_info['index'], token_info['failures'])
+        return token_info['token']
+    
+    def _admit_recovered_tokens(self) -> None:
+        """将到达探测时间的失效token重新激活（需持有锁）"""
+        now = time.monotonic()
+        heap = self._recovery_heap
+        while heap and heap[0][0] <= now:
+            probe_at, _, token_info = heapq.heappop(heap)
+            # 已被手动重置或重新调度的记录直接丢弃
+            if token_info['is_active'] or token_info['probe_at'] != probe_at:
+                continue
+            
+            token_info['probe_at'] = None
+            # 探测期间再失败一次即重新失效
+            self._set_failures(token_info, self.max_failures - 1)
+            self._set_active(token_info, True)
+            logger.info("Token重新进入探测 (索引: %d, 第%d次失效后)",
+                        token_info['index'], token_info['disabled_count'])
+        self._next_probe_at = heap[0][0] if heap else float('inf')
+    
+    def _set_failures(self, token_info: Dict, failures: int) -> None:
+        """更新token失败次数并同步失败分布计数（需持有锁）"""
+        counts = self._failure_counts
+        old = token_info['failures']
+        counts[old] -= 1
+        if not counts[old]:
+            del counts[old]
+        counts[failures] += 1
+        token_info['failures'] = failures
+    
+    def _set_active(self, token_info: Dict, active: bool) -> None:
+        """更新token活跃状态并同步活跃标志和计数（需持有锁）"""
+        token_info['is_active'] = active
+        self._rotation[1][token_info['slot']] = active
+        self._active_count += 1 if active else -1
+    
+    def _deactivate(self, token_info: Dict) -> None:
+        """将token标记为失效（轮询时跳过），并按指数退避安排重新探测（需持有锁）"""
+        self._set_active(token_info, False)
+        token_info['disabled_count'] += 1
+        
+        if self.recovery_delay > 0:
+            delay = self.recovery_delay * (2 ** min(token_info['disabled_count'] - 1, 6))
+            probe_at = time.monotonic() + delay
+            token_info['probe_at'] = probe_at
+            heapq.heappush(self._recovery_heap, (probe_at, token_info['index'], token_info))
+            self._next_probe_at = min(self._next_probe_at, probe_at)
     
     def mark_token_failure(self, token: str, error_message: str = "") -> bool:
         """
@@ -119,26 +216,31 @@ class TokenManager:
         Returns:
             如果token被标记为失效返回True，否则返回False
         """
+        now = time.monotonic()
         with self.lock:
-            for token_info in self.tokens:
-                if token_info['token'] == token:
-                    token_info['failures'] += 1
-                    token_info['last_failure'] = datetime.now()
-                    
-                    logger.warning(f"Token失败 (索引: {token_info['index']}, "
-                                 f"失败次数: {token_info['failures']}/{self.max_failures}): {safe_str(error_message)}")
-                    
-                    # 检查是否达到最大失败次数
-                    if token_info['failures'] >= self.max_failures:
-                        token_info['is_active'] = False
-                        logger.error(f"Token已失效 (索引: {token_info['index']}, "
-                                   f"失败次数: {token_info['failures']})")
-                        return True
-                    
-                    return False
-            
+            token_info = self._by_token.get(token)
+            if token_info is not None:
+                failures = token_info['failures'] + 1
+                self._set_failures(token_info, failures)
+                token_info['last_failure'] = now
+                
+                # 检查是否达到最大失败次数
+                disabled = failures >= self.max_failures
+                if disabled and token_info['is_active']:
+                    self._deactivate(token_info)
+        
+        # 日志在锁外输出，缩短持锁时间
+        if token_info is None:
             logger.warning("未找到匹配的token进行失败标记")
             return False
+        
+        logger.warning("Token失败 (索引: %d, 失败次数: %d/%d): %s",
+                     token_info['index'], failures,
+                     self.max_failures, safe_str(error_message))
+        if disabled:
+            logger.error("Token已失效 (索引: %d, 失败次数: %d)",
+                       token_info['index'], failures)
+        return disabled
     
     def mark_token_success(self, token: str) -> None:
         """
@@ -148,13 +250,17 @@ class TokenManager:
             token: 成功的token
         """
         with self.lock:
-            for token_info in self.tokens:
-                if token_info['token'] == token:
-                    if token_info['failures'] > 0:
-                        logger.info(f"Token恢复 (索引: {token_info['index']}, "
-                                  f"重置失败次数: {token_info['failures']} -> 0)")
-                        token_info['failures'] = 0
-                    return
+            token_info = self._by_token.get(token)
+            if token_info is None:
+                return
+            old_failures = token_info['failures']
+            if old_failures > 0:
+                self._set_failures(token_info, 0)
+            token_info['disabled_count'] = 0
+        
+        if old_failures > 0:
+            logger.info("Token恢复 (索引: %d, 重置失败次数: %d -> 0)",
+                      token_info['index'], old_failures)
     
     def get_token_stats(self) -> Dict:
         """
@@ -164,14 +270,11 @@ class TokenManager:
             包含统计信息的字典
         """
         with self.lock:
+            # 活跃数和失败分布均由计数器维护，无需遍历token列表
             total = len(self.tokens)
-            active = sum(1 for t in self.tokens if t['is_active'])
+            active = self._active_count
             inactive = total - active
-            
-            failure_distribution = {}
-            for token_info in self.tokens:
-                failures = token_info['failures']
-                failure_distribution[failures] = failure_distribution.get(failures, 0) + 1
+            failure_distribution = dict(self._failure_counts)
             
             return {
                 'total_tokens': total,
@@ -198,9 +301,12 @@ class TokenManager:
                 old_failures = token_info['failures']
                 old_active = token_info['is_active']
                 
-                token_info['failures'] = 0
-                token_info['is_active'] = True
+                self._set_failures(token_info, 0)
                 token_info['last_failure'] = None
+                token_info['disabled_count'] = 0
+                token_info['probe_at'] = None
+                if not old_active:
+                    self._set_active(token_info, True)
                 
                 logger.info(f"Token重置 (索引: {token_index}, "
                            f"失败次数: {old_failures} -> 0, "
@@ -220,6 +326,15 @@ class TokenManager:
                     token_info['is_active'] = True
                     token_info['last_failure'] = None
                     reset_count += 1
+                token_info['disabled_count'] = 0
+                token_info['probe_at'] = None
+            
+            # 原地改写标志，保持与当前快照的配对
+            self._rotation[1][:] = b"\x01" * len(self.tokens)
+            self._active_count = len(self.tokens)
+            self._recovery_heap = []
+            self._next_probe_at = float('inf')
+            self._failure_counts = Counter({0: len(self.tokens)}) if self.tokens else Counter()
             
             logger.info(f"重置了 {reset_count} 个token，当前活跃token数: {len(self.tokens)}")
     
@@ -240,11 +355,8 @@ class TokenManager:
             return None
 
     def is_token(self, token: str) -> bool:
-        for tk in self.tokens:
-            if token == tk.get('token'):
-                return True
-        else:
-            return False
+        """判断token是否在当前token池中"""
+        return token in self._by_token
 
     @staticmethod
     def generate_random_tokens():
@@ -254,9 +366,47 @@ class TokenManager:
         return tokens
 
     def save_tokens(self, tokens: List[str]):
-        with open(self.tokens_file, 'w', encoding='utf-8') as f:
-            for token in tokens:
-                if isinstance(token, str) and token.strip():
-                    f.write(token.strip() + '\n')
+        """写入token文件并直接用写入的内容更新token池（阻塞操作）"""
+        lines = [token.strip() for token in tokens if isinstance(token, str) and token.strip()]
+        content = "".join(line + "\n" for line in lines).encode("utf-8")
+        
+        # 先写临时文件再原子替换，避免写入中途被读取到不完整的文件
+        tmp_file = f"{self.tokens_file}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.tokens_file)
+
+        # 内存中的token池直接按写入内容重建，无需再读取和解析刚写入的文件
+        old_count = len(self.tokens)
+        self._install_tokens(lines)
+        logger.info("Token已保存: %d -> %d", old_count, len(self.tokens))
 
-        self.reload_tokens()
+    async def save_tokens_async(self, tokens: List[str]) -> None:
+        """
+        在线程中保存token，不阻塞事件循环
+        防抖窗口内的多次更新合并为一次写入，以最后一次提交的内容为准；
+        所有调用方通过shield等待同一个写入任务，单个调用方被取消不会影响写入和其他等待者
+        """
+        self._pending_tokens = tokens
+        task = self._save_future
+        if task is None or task.done():
+            task = asyncio.ensure_future(self._run_debounced_save())
+            task.add_done_callback(self._on_save_done)
+            self._save_future = task
+        await asyncio.shield(task)
+    
+    async def _run_debounced_save(self) -> None:
+        """等待防抖窗口后写入；写入期间有新的提交时继续写入，保证等待者的内容都已落盘"""
+        while self._pending_tokens is not None:
+            await asyncio.sleep(self.SAVE_DEBOUNCE)
+            pending, self._pending_tokens = self._pending_tokens, None
+            await asyncio.to_thread(self.save_tokens, pending)
+    
+    def _on_save_done(self, task: asyncio.Future) -> None:
+        """写入任务结束后清除引用，并获取异常避免无人等待时产生警告"""
+        if self._save_future is task:
+            self._save_future = None
+        if not task.cancelled():
+            task.exception()
@@ -2,77 +2,206 @@
 工具处理模块
 处理工具调用相关的所有逻辑
 """
+import asyncio
+import itertools
 import json
 import re
-import time
+import secrets
 import logging
-from typing import List, Dict, Optional, Union
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple, Union
+import orjson
 
 from src.constants import (
     ToolConstants, ContentConstants, LogMessages, 
-    TimeConstants
+    NumericConstants
 )
 from src.exceptions import ToolProcessingError
+from src.models import ContentPart, ImagePart, TextPart
+from src.utils import dump_json_bytes, load_json_bytes
+
+try:
+    # 可选依赖：RE2为线性时间匹配，长响应中不会因 .*? 回溯而退化
+    import re2
+except ImportError:
+    re2 = None
 
 logger = logging.getLogger(__name__)
 
+# 工具调用ID = 前缀 + 进程级随机段 + 单调递增计数（next()在GIL下是原子的）
+_CALL_ID_PREFIX = f"{ToolConstants.CALL_ID_PREFIX}{secrets.token_hex(4)}_"
+_call_id_counter = itertools.count()
+
+
+def _compile_linear(pattern: str):
+    """优先使用RE2编译正则，未安装时回退到标准库re（DOTALL模式）"""
+    if re2 is not None:
+        return re2.compile("(?s)" + pattern)
+    return re.compile(pattern, re.DOTALL)
+
+
+def _build_tool_prompt(tools: List[Dict]) -> str:
+    """根据工具定义生成简洁的工具注入提示（所有片段追加到同一列表，最后一次拼接）"""
+    parts = ["\n\nAvailable tools: "]
+    has_tool = False
+    for tool in tools:
+        if tool.get("type") != ToolConstants.FUNCTION_TYPE:
+            continue
+
+        function_spec = tool.get("function", {}) or {}
+        function_name = function_spec.get("name", "unknown")
+        function_description = function_spec.get("description", "")
+        parameters = function_spec.get("parameters", {}) or {}
+
+        # 工具之间以分号分隔
+        if has_tool:
+            parts.append("; ")
+        has_tool = True
+
+        # 创建简洁的工具定义
+        parts.append(f"{function_name}: {function_description}")
+        
+        # 添加简化的参数信息
+        parameter_properties = parameters.get("properties", {}) or {}
+        if parameter_properties:
+            required_parameters = set(parameters.get("required", []) or [])
+            parts.append(" Parameters: ")
+            parts.append(", ".join(
+                f"{param_name}{'*' if param_name in required_parameters else ''}: "
+                f"{(param_details or {}).get('description', '')}"
+                for param_name, param_details in parameter_properties.items()
+            ))
+
+    if not has_tool:
+        return ""
+
+    # 构建简洁的工具提示
+    parts.append(
+        ". "
+        "To use a tool, respond with JSON: "
+        '{"tool_calls":[{"id":"call_xxx","type":"function","function":{"name":"tool_name","arguments":"{\\"param\\":\\"value\\"}"}}]}'
+    )
+    return "".join(parts)
+
+
+@lru_cache(maxsize=ToolConstants.TOOL_PROMPT_CACHE_SIZE)
+def _cached_tool_prompt(tools_key: bytes) -> str:
+    """按工具定义的序列化内容缓存工具提示，客户端通常每次请求都发送相同的工具定义"""
+    return _build_tool_prompt(orjson.loads(tools_key))
+
+
+def _dump_arguments(value) -> str:
+    """将工具参数序列化为JSON字符串，orjson无法处理的对象（如超出64位的整数）回退到标准库"""
+    try:
+        return dump_json_bytes(value).decode("utf-8")
+    except TypeError:
+        return json.dumps(value, ensure_ascii=False)
+
+
+def _attr_part_text(part) -> Optional[str]:
+    """ContentPart对象：取非空的text属性"""
+    return part.text or None
+
+
+def _dict_part_text(part: dict) -> Optional[str]:
+    """字典格式的内容片段：文本取text，图像使用占位文本"""
+    part_type = part.get("type")
+    if part_type == ContentConstants.TEXT_TYPE:
+        return part.get("text", "")
+    if part_type == ContentConstants.IMAGE_URL_TYPE:
+        # 处理图像内容，添加描述性文本
+        return ContentConstants.IMAGE_PLACEHOLDER
+    return None
+
+
+def _other_part_text(part) -> Optional[str]:
+    """精确类型未命中的内容片段：按isinstance兼容子类，否则优先取text属性或转换为字符串"""
+    if hasattr(part, 'text'):
+        return getattr(part, 'text', None) or None
+    if isinstance(part, dict):
+        return _dict_part_text(part)
+    if isinstance(part, str):
+        return part
+    try:
+        if hasattr(part, '__dict__'):
+            return None
+        return str(part)
+    except Exception:
+        return None
+
+
+# 列表内容片段按具体类型分派
+_PART_TEXT = {
+    TextPart: _attr_part_text,
+    ImagePart: _attr_part_text,
+    ContentPart: _attr_part_text,
+    dict: _dict_part_text,
+    str: lambda part: part,
+}
+
+
+def _list_content_to_string(content: list) -> str:
+    """多段内容以空格拼接，跳过没有文本的片段"""
+    parts = []
+    for part in content:
+        text = _PART_TEXT.get(type(part), _other_part_text)(part)
+        if text is not None:
+            parts.append(text)
+    return " ".join(parts)
+
+
+def _other_content_to_string(content) -> str:
+    """精确类型未命中的内容：str/list子类按isinstance处理，其他类型直接转换为字符串"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return _list_content_to_string(content)
+    try:
+        return str(content)
+    except Exception:
+        return ""
+
+
+# 消息内容按具体类型分派（str为最常见情况，一次字典查找即可返回）
+_CONTENT_TO_STRING = {
+    str: lambda content: content,
+    list: _list_content_to_string,
+    type(None): lambda content: "",
+}
+
+
 class ToolHandler:
     """工具调用处理器"""
     
     # 工具调用提取模式
-    TOOL_CALL_FENCE_PATTERN = re.compile(r"```json\s*(\{.*?\})\s*```", re.DOTALL)
+    TOOL_CALL_FENCE_PATTERN = _compile_linear(r"```json\s*(\{.*?\})\s*```")
+    # RE2的\w只匹配ASCII，函数名可能含中文，此模式保留标准库re
     FUNCTION_CALL_PATTERN = re.compile(
         r"调用函数\s*[：:]\s*([\w\-\.]+)\s*(?:参数|arguments)[：:]\s*(\{.*?\})", 
         re.DOTALL
     )
+    # 所有工具调用形式共有的标记，子串查找判断文本是否可能包含工具调用
+    TOOL_MARKERS = ("tool_calls", "调用函数")
+    # 复用的JSON解码器，raw_decode在C层完成对象边界匹配
+    _JSON_DECODER = json.JSONDecoder()
+    # JSON对象只可能以 {" 或 {} 开头（中间允许空白），据此跳过正文中的普通括号
+    JSON_OBJECT_START_PATTERN = re.compile(r'\{\s*["}]')
     
     def __init__(self, config):
         self.config = config
         self.tool_support = config.TOOL_SUPPORT
     
     def generate_tool_prompt(self, tools: List[Dict]) -> str:
-        """生成简洁的工具注入提示"""
+        """生成简洁的工具注入提示（相同工具定义复用缓存结果）"""
         if not tools:
             return ""
-
-        tool_definitions = []
-        for tool in tools:
-            if tool.get("type") != ToolConstants.FUNCTION_TYPE:
-                continue
-
-            function_spec = tool.get("function", {}) or {}
-            function_name = function_spec.get("name", "unknown")
-            function_description = function_spec.get("description", "")
-            parameters = function_spec.get("parameters", {}) or {}
-
-            # 创建简洁的工具定义
-            tool_info = f"{function_name}: {function_description}"
-            
-            # 添加简化的参数信息
-            parameter_properties = parameters.get("properties", {}) or {}
-            required_parameters = set(parameters.get("required", []) or [])
-
-            if parameter_properties:
-                param_list = []
-                for param_name, param_details in parameter_properties.items():
-                    param_desc = (param_details or {}).get("description", "")
-                    is_required = param_name in required_parameters
-                    param_list.append(f"{param_name}{'*' if is_required else ''}: {param_desc}")
-                tool_info += f" Parameters: {', '.join(param_list)}"
-
-            tool_definitions.append(tool_info)
-
-        if not tool_definitions:
-            return ""
-
-        # 构建简洁的工具提示
-        prompt_template = (
-            f"\n\nAvailable tools: {'; '.join(tool_definitions)}. "
-            "To use a tool, respond with JSON: "
-            '{"tool_calls":[{"id":"call_xxx","type":"function","function":{"name":"tool_name","arguments":"{\\"param\\":\\"value\\"}"}}]}'
-        )
-
-        return prompt_template
+        
+        try:
+            # 不排序键：参数顺序会影响提示内容
+            tools_key = orjson.dumps(tools)
+        except TypeError:
+            return _build_tool_prompt(tools)
+        return _cached_tool_prompt(tools_key)
     
     def process_messages_with_tools(
         self, 
@@ -80,10 +209,13 @@ class ToolHandler:
         tools: Optional[List[Dict]] = None, 
         tool_choice: Optional[Union[str, Dict]] = None
     ) -> List[Dict]:
-        """处理消息并注入工具提示"""
+        """
+        处理消息并注入工具提示
+        返回的列表中未改动的消息直接引用原字典，调用方不应修改返回的消息
+        """
         if not tools or not self.tool_support or (tool_choice == "none"):
             # 如果没有工具或禁用工具，直接返回原消息
-            return [dict(m) for m in messages]
+            return list(messages)
         
         tools_prompt = self.generate_tool_prompt(tools)
         
@@ -92,67 +224,54 @@ class ToolHandler:
             logger.warning(LogMessages.TOOL_PROMPT_TOO_LONG.format(len(tools_prompt)))
             tools_prompt = tools_prompt[:ToolConstants.MAX_TOOL_PROMPT_LENGTH] + ToolConstants.TOOL_PROMPT_TRUNCATE_SUFFIX
         
-        processed = []
-        has_system = any(m.get("role") == "system" for m in messages)
-
-        if has_system:
-            # 如果已有系统消息，在第一个系统消息中添加工具提示
-            for m in messages:
-                if m.get("role") == "system":
-                    mm = dict(m)
-                    content = self._content_to_string(mm.get("content", ""))
-                    # 不限制系统消息长度
-                    new_content = content + tools_prompt
-                    mm["content"] = new_content
-                    processed.append(mm)
-                    # 只在第一个系统消息中添加工具提示
-                    tools_prompt = ""
-                else:
-                    processed.append(dict(m))
-        else:
-            # 如果没有系统消息，需要添加一个，但只有当确实需要工具时
-            if tools_prompt.strip():
-                processed = [{"role": "system", "content": "你是一个有用的助手。" + tools_prompt}]
-                processed.extend([dict(m) for m in messages])
-            else:
-                processed = [dict(m) for m in messages]
-
-        # 添加简化的工具选择提示
+        # 简化的工具选择提示，追加到最后一条用户消息
+        choice_hint = ""
         if tool_choice == "required":
-            if processed and processed[-1].get("role") == "user":
-                last = processed[-1]
-                content = self._content_to_string(last.get("content", ""))
-                last["content"] = content + "\n请使用工具来处理这个请求。"
+            choice_hint = "\n请使用工具来处理这个请求。"
         elif isinstance(tool_choice, dict) and tool_choice.get("type") == ToolConstants.FUNCTION_TYPE:
             fname = (tool_choice.get("function") or {}).get("name")
-            if fname and processed and processed[-1].get("role") == "user":
-                last = processed[-1]
-                content = self._content_to_string(last.get("content", ""))
-                last["content"] = content + f"\n请使用 {fname} 工具。"
-
-        # 处理工具/函数消息
+            if fname:
+                choice_hint = f"\n请使用 {fname} 工具。"
+        
         final_msgs = []
-        for m in processed:
+        system_prompt = tools_prompt
+        if not any(m.get("role") == "system" for m in messages):
+            # 如果没有系统消息，需要添加一个，但只有当确实需要工具时
+            if tools_prompt.strip():
+                final_msgs.append({"role": "system", "content": "你是一个有用的助手。" + tools_prompt})
+            system_prompt = ""
+        
+        last_index = len(messages) - 1
+        for i, m in enumerate(messages):
             role = m.get("role")
             if role in ("tool", "function"):
+                # 简化工具结果消息
                 tool_name = m.get("name", "unknown")
                 tool_content = self._content_to_string(m.get("content", ""))
-                if isinstance(tool_content, dict):
-                    tool_content = json.dumps(tool_content, ensure_ascii=False)
-
-                # 简化工具结果消息
                 content = f"工具 {tool_name} 结果: {tool_content}"
                 if not content.strip():
                     content = f"工具 {tool_name} 执行完成"
-
                 final_msgs.append({
                     "role": "assistant",
                     "content": content,
                 })
+                continue
+            
+            # 对于常规消息，确保内容是字符串格式
+            original = m.get("content", "")
+            content = self._content_to_string(original)
+            if role == "system" and system_prompt:
+                # 只在第一个系统消息中添加工具提示
+                content += system_prompt
+                system_prompt = ""
+            if choice_hint and i == last_index and role == "user":
+                content += choice_hint
+            
+            if content is original and "content" in m:
+                # 内容未变化，无需复制消息
+                final_msgs.append(m)
             else:
-                # 对于常规消息，确保内容是字符串格式
                 final_msg = dict(m)
-                content = self._content_to_string(final_msg.get("content", ""))
                 final_msg["content"] = content
                 final_msgs.append(final_msg)
 
@@ -163,38 +282,39 @@ class ToolHandler:
         if not text:
             return None
 
-        # 使用全文扫描，不限制长度
-        scannable_text = text
+        # 围栏和内联形式都需要tool_calls键，自然语言形式需要"调用函数"，不含对应标记的扫描直接跳过
+        if "tool_calls" in text:
+            # 尝试1：从JSON代码块中提取（逐个匹配，找到即停止）
+            for fence_match in self.TOOL_CALL_FENCE_PATTERN.finditer(text):
+                try:
+                    parsed_data = load_json_bytes(fence_match.group(1))
+                    tool_calls = parsed_data.get("tool_calls")
+                    if tool_calls and isinstance(tool_calls, list):
+                        # 确保arguments字段是字符串
+                        self._normalize_tool_calls(tool_calls)
+                        return tool_calls
+                except (json.JSONDecodeError, AttributeError):
+                    continue
 
-        # 尝试1：从JSON代码块中提取
-        json_blocks = self.TOOL_CALL_FENCE_PATTERN.findall(scannable_text)
-        for json_block in json_blocks:
-            try:
-                parsed_data = json.loads(json_block)
-                tool_calls = parsed_data.get("tool_calls")
-                if tool_calls and isinstance(tool_calls, list):
-                    # 确保arguments字段是字符串
-                    self._normalize_tool_calls(tool_calls)
-                    return tool_calls
-            except (json.JSONDecodeError, AttributeError):
-                continue
+            # 尝试2：使用括号平衡方法提取内联JSON对象
+            tool_calls = self._extract_inline_json_tool_calls(text)
+            if tool_calls:
+                return tool_calls
 
-        # 尝试2：使用括号平衡方法提取内联JSON对象
-        tool_calls = self._extract_inline_json_tool_calls(scannable_text)
-        if tool_calls:
-            return tool_calls
+        if "调用函数" not in text:
+            return None
 
         # 尝试3：解析自然语言函数调用
-        natural_lang_match = self.FUNCTION_CALL_PATTERN.search(scannable_text)
+        natural_lang_match = self.FUNCTION_CALL_PATTERN.search(text)
         if natural_lang_match:
             function_name = natural_lang_match.group(1).strip()
             arguments_str = natural_lang_match.group(2).strip()
             try:
                 # 验证JSON格式
-                json.loads(arguments_str)
+                load_json_bytes(arguments_str)
                 return [
                     {
-                        "id": f"{ToolConstants.CALL_ID_PREFIX}{int(time.time() * TimeConstants.MICROSECONDS_MULTIPLIER)}",
+                        "id": f"{_CALL_ID_PREFIX}{next(_call_id_counter):x}",
                         "type": ToolConstants.FUNCTION_TYPE,
                         "function": {"name": function_name, "arguments": arguments_str},
                     }
@@ -204,13 +324,50 @@ class ToolHandler:
 
         return None
     
+    def _has_tool_marker(self, text: str) -> bool:
+        """判断文本是否含有工具调用标记（C层子串查找，比正则扫描更快）"""
+        for marker in self.TOOL_MARKERS:
+            if marker in text:
+                return True
+        return False
+    
+    def split_tool_calls(self, text: str) -> Tuple[Optional[List[Dict]], str]:
+        """
+        从响应文本中分离工具调用和正文内容
+        
+        Returns:
+            (tool_calls, content)：提取到工具调用时content为空字符串，
+            否则tool_calls为None，content为移除工具JSON后的文本
+        """
+        if not text or not self._has_tool_marker(text):
+            # 不含任何工具标记，跳过提取和清理的全文扫描
+            return None, text.strip() if text else text
+        
+        tool_calls = self.extract_tool_invocations(text)
+        if tool_calls:
+            return tool_calls, ""
+        return None, self.remove_tool_json_content(text)
+    
+    async def split_tool_calls_async(self, text: str) -> Tuple[Optional[List[Dict]], str]:
+        """
+        异步分离工具调用和正文内容
+        长文本的全文扫描放到线程中执行，避免阻塞事件循环；
+        split_tool_calls只读取类级别的预编译正则，不修改实例状态，可在线程中安全调用
+        """
+        if text and len(text) >= NumericConstants.TOOL_PARSE_OFFLOAD_THRESHOLD:
+            return await asyncio.to_thread(self.split_tool_calls, text)
+        return self.split_tool_calls(text)
+    
     def remove_tool_json_content(self, text: str) -> str:
         """从响应文本中移除工具JSON内容 - 使用括号平衡方法"""
+        if "tool_calls" not in text:
+            # 只有含tool_calls的JSON会被移除，无需扫描
+            return text.strip()
         
-        def remove_tool_call_block(match: re.Match) -> str:
+        def remove_tool_call_block(match) -> str:
             json_content = match.group(1)
             try:
-                parsed_data = json.loads(json_content)
+                parsed_data = load_json_bytes(json_content)
                 if "tool_calls" in parsed_data:
                     return ""
             except (json.JSONDecodeError, AttributeError):
@@ -220,143 +377,64 @@ class ToolHandler:
         # 步骤1：移除围栏工具JSON块
         cleaned_text = self.TOOL_CALL_FENCE_PATTERN.sub(remove_tool_call_block, text)
         
-        # 步骤2：移除内联工具JSON - 使用基于括号平衡的智能方法
+        # 步骤2：移除内联工具JSON - 由C实现的JSON扫描器完成括号匹配
+        search = self.JSON_OBJECT_START_PATTERN.search
         result = []
-        i = 0
-        while i < len(cleaned_text):
-            if cleaned_text[i] == '{':
-                # 尝试找到匹配的右括号
-                brace_count = 1
-                j = i + 1
-                in_string = False
-                escape_next = False
-                
-                while j < len(cleaned_text) and brace_count > 0:
-                    if escape_next:
-                        escape_next = False
-                    elif cleaned_text[j] == '\\':
-                        escape_next = True
-                    elif cleaned_text[j] == '"' and not escape_next:
-                        in_string = not in_string
-                    elif not in_string:
-                        if cleaned_text[j] == '{':
-                            brace_count += 1
-                        elif cleaned_text[j] == '}':
-                            brace_count -= 1
-                    j += 1
-                
-                if brace_count == 0:
-                    # 找到了完整的JSON对象
-                    json_str = cleaned_text[i:j]
-                    try:
-                        parsed = json.loads(json_str)
-                        if "tool_calls" in parsed:
-                            # 这是一个工具调用，跳过它
-                            i = j
-                            continue
-                    except:
-                        pass
-                
-                # 不是工具调用或无法解析，保留这个字符
-                result.append(cleaned_text[i])
-                i += 1
+        last = 0
+        match = search(cleaned_text)
+        while match:
+            i = match.start()
+            parsed, end = self._decode_json_object(cleaned_text, i)
+            if parsed is not None and "tool_calls" in parsed:
+                # 这是一个工具调用，跳过整个对象
+                result.append(cleaned_text[last:i])
+                last = end
+                match = search(cleaned_text, end)
             else:
-                result.append(cleaned_text[i])
-                i += 1
+                # 不是工具调用或无法解析，从下一个候选位置继续
+                match = search(cleaned_text, i + 1)
+        result.append(cleaned_text[last:])
         
         return ''.join(result).strip()
     
     def _extract_inline_json_tool_calls(self, text: str) -> Optional[List[Dict]]:
-        """使用括号平衡方法提取内联JSON工具调用"""
-        i = 0
-        while i < len(text):
-            if text[i] == '{':
-                # 尝试找到匹配的右括号
-                brace_count = 1
-                j = i + 1
-                in_string = False
-                escape_next = False
-                
-                while j < len(text) and brace_count > 0:
-                    if escape_next:
-                        escape_next = False
-                    elif text[j] == '\\':
-                        escape_next = True
-                    elif text[j] == '"' and not escape_next:
-                        in_string = not in_string
-                    elif not in_string:
-                        if text[j] == '{':
-                            brace_count += 1
-                        elif text[j] == '}':
-                            brace_count -= 1
-                    j += 1
-                
-                if brace_count == 0:
-                    # 找到了完整的JSON对象
-                    json_str = text[i:j]
-                    try:
-                        parsed_data = json.loads(json_str)
-                        tool_calls = parsed_data.get("tool_calls")
-                        if tool_calls and isinstance(tool_calls, list):
-                            # 确保arguments字段是字符串
-                            self._normalize_tool_calls(tool_calls)
-                            return tool_calls
-                    except (json.JSONDecodeError, AttributeError):
-                        pass
-                
-                i += 1
-            else:
-                i += 1
+        """逐个尝试从左括号处解码内联JSON对象，提取工具调用"""
+        search = self.JSON_OBJECT_START_PATTERN.search
+        match = search(text)
+        while match:
+            parsed_data, _ = self._decode_json_object(text, match.start())
+            if parsed_data is not None:
+                tool_calls = parsed_data.get("tool_calls")
+                if tool_calls and isinstance(tool_calls, list):
+                    # 确保arguments字段是字符串
+                    self._normalize_tool_calls(tool_calls)
+                    return tool_calls
+            match = search(text, match.start() + 1)
         
         return None
     
+    def _decode_json_object(self, text: str, start: int) -> Tuple[Optional[Dict], int]:
+        """
+        从start处的左括号解码一个完整JSON对象
+        
+        Returns:
+            (对象, 结束位置)；无法解码时返回(None, start)
+        """
+        try:
+            return self._JSON_DECODER.raw_decode(text, start)
+        except ValueError:
+            return None, start
+    
     def _normalize_tool_calls(self, tool_calls: List[Dict]) -> None:
         """标准化工具调用，确保arguments字段是字符串"""
         for tc in tool_calls:
             if "function" in tc:
                 func = tc["function"]
                 if "arguments" in func:
-                    if isinstance(func["arguments"], dict):
-                        # 将字典转换为JSON字符串
-                        func["arguments"] = json.dumps(func["arguments"], ensure_ascii=False)
-                    elif not isinstance(func["arguments"], str):
-                        func["arguments"] = json.dumps(func["arguments"], ensure_ascii=False)
+                    if not isinstance(func["arguments"], str):
+                        # 将字典等对象转换为JSON字符串
+                        func["arguments"] = _dump_arguments(func["arguments"])
     
     def _content_to_string(self, content) -> str:
-        """将各种格式的内容转换为字符串"""
-        if content is None:
-            return ""
-        if isinstance(content, str):
-            return content
-        if isinstance(content, list):
-            parts = []
-            for p in content:
-                if hasattr(p, 'text'):  # ContentPart object
-                    if getattr(p, 'text', None):
-                        parts.append(getattr(p, 'text', ''))
-                elif isinstance(p, dict):
-                    if p.get("type") == ContentConstants.TEXT_TYPE:
-                        parts.append(p.get("text", ""))
-                    elif p.get("type") == ContentConstants.IMAGE_URL_TYPE:
-                        # 处理图像内容，添加描述性文本
-                        parts.append(ContentConstants.IMAGE_PLACEHOLDER)
-                elif isinstance(p, str):
-                    parts.append(p)
-                else:
-                    # 处理其他类型的对象
-                    try:
-                        if hasattr(p, '__dict__'):
-                            # 如果是对象，尝试获取text属性或转换为字符串
-                            text_attr = getattr(p, 'text', None)
-                            if text_attr:
-                                parts.append(str(text_attr))
-                        else:
-                            parts.append(str(p))
-                    except:
-                        continue
-            return " ".join(parts)
-        # 处理其他类型
-        try:
-            return str(content)
-        except:
-            return ""
\ No newline at end of file
+        """将各种格式的内容转换为字符串（按内容的具体类型分派）"""
+        return _CONTENT_TO_STRING.get(type(content), _other_content_to_string)(content)
@@ -2,9 +2,13 @@
 工具函数模块
 包含通用的工具函数
 """
+import json
 import logging
 import sys
 
+import orjson
+from fastapi.responses import JSONResponse
+
 
 def safe_str(obj) -> str:
     """
@@ -16,6 +20,12 @@ def safe_str(obj) -> str:
     Returns:
         str: 安全转换后的字符串
     """
+    # 绝大多数调用传入的就是str，精确类型判断后直接返回
+    obj_type = type(obj)
+    if obj_type is str:
+        return obj
+    if obj_type is bytes:
+        return obj.decode('utf-8', errors='replace')
     try:
         if isinstance(obj, str):
             return obj
@@ -41,11 +51,14 @@ def safe_encode(text: str, encoding: str = 'utf-8') -> bytes:
     Returns:
         bytes: 编码后的字节
     """
+    # 精确类型的bytes无需编码，直接返回（编码名无效时str.encode会抛出LookupError，编码需留在try内）
+    if type(text) is bytes:
+        return text
     try:
-        if isinstance(text, bytes):
-            return text
-        elif isinstance(text, str):
+        if isinstance(text, str):
             return text.encode(encoding, errors='replace')
+        elif isinstance(text, bytes):
+            return text
         else:
             return str(text).encode(encoding, errors='replace')
     except Exception:
@@ -53,6 +66,49 @@ def safe_encode(text: str, encoding: str = 'utf-8') -> bytes:
         return b'<encoding_error>'
 
 
+def dump_json_bytes(obj) -> bytes:
+    """
+    使用orjson将对象序列化为紧凑的UTF-8 JSON字节
+    
+    Args:
+        obj: 可JSON序列化的对象（允许非字符串键）
+        
+    Returns:
+        bytes: 序列化后的字节
+        
+    Raises:
+        orjson.JSONEncodeError: 对象无法序列化时
+    """
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+def load_json_bytes(data: bytes):
+    """
+    使用orjson直接从字节反序列化JSON，失败时回退到标准库json
+    
+    Args:
+        data: UTF-8编码的JSON字节（也接受str）
+        
+    Returns:
+        反序列化后的对象
+        
+    Raises:
+        ValueError: 内容不是合法JSON时
+    """
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        # 标准库可接受NaN/Infinity等orjson拒绝的非严格JSON
+        return json.loads(data)
+
+
+class ORJSONResponse(JSONResponse):
+    """使用orjson直接输出字节的JSON响应"""
+    
+    def render(self, content) -> bytes:
+        return dump_json_bytes(content)
+
+
 def configure_logging_encoding():
     """
     配置日志系统以支持UTF-8编码，避免ASCII编码错误